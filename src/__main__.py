@@ -46,6 +46,7 @@ class CrystalApp(tk.Tk):
     self.ConfigureTags()
 
     self.drs = None
+    self.session = engine.logic.Session()
     self.thread = None
     self.queue = Queue.Queue()
     
@@ -107,8 +108,10 @@ class CrystalApp(tk.Tk):
       self.text.delete(1.0, tk.END)
       self.text.config(state=tk.DISABLED)
       self.drs = None
+      self.session = engine.logic.Session()
     else:
-      self.StartThread(ProcessStringGateway, (input, self.drs, self.queue))
+      self.StartThread(ProcessStringGateway,
+                       (input, self.drs, self.queue, self.session))
 
   def StartThread(self, target, args):
     self.thread = threading.Thread(target=target, args=args)
@@ -137,9 +140,9 @@ class CrystalApp(tk.Tk):
       self.label.config(foreground='black')
 
 
-def ProcessStringGateway(input, drs, queue):
+def ProcessStringGateway(input, drs, queue, session):
   try:
-    engine.ProcessString(input, drs, queue)
+    engine.ProcessString(input, drs, queue, session)
   except Exception, e:
     queue.put(('post', 'Error encountered in child thread.', 'problem'))
     raise
@@ -1,6 +1,8 @@
 import os
+import cfg_parser
 import adjectives
 import conjunctions
+import hypernyms
 import names
 import nouns
 import verbs
@@ -43,4 +45,13 @@ def BuildGrammar():
   outfile.close()
   patterns_file.close()
 
+  print '\tCompiling grammar...'
+  cfg_parser.CompileGrammar(GRAMMAR_PATH)
+
+  print '\tPrecomputing hypernyms...'
+  hypernyms.WriteTemplates(GRAMMAR_PATH)
+
+  print '\tPrecomputing verb frames...'
+  verbs.WriteFrames(PATTERNS_PATH)
+
   print '\tDone.'
@@ -0,0 +1,23 @@
+import re
+import cPickle as pickle
+
+
+HYPERNYMS_PATH = 'data/hypernyms.pickle'
+SYNSET_REGEX = re.compile(r'^(?:Noun|Verb)\[.*?SNS="([^"]+)"')
+
+
+def WriteTemplates(grammar_path):
+  # Imported here since the rules module needs the patterns written earlier
+  # in the build.
+  import drt.rules
+
+  synsets = set([drt.rules._PERSON_SYNSET])
+  synsets.update(drt.rules._MALE_SYNSETS)
+  synsets.update(drt.rules._FEMALE_SYNSETS)
+  for line in open(grammar_path):
+    match = SYNSET_REGEX.match(line)
+    if match:
+      synsets.add(match.group(1))
+
+  templates = dict((i, drt.rules.MakeHypernymTemplate(i)) for i in synsets)
+  pickle.dump(templates, open(HYPERNYMS_PATH, 'wb'), pickle.HIGHEST_PROTOCOL)
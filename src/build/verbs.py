@@ -8,6 +8,7 @@ import base
 
 
 VERBS_LIST = 'data/verbs.pickle'
+FRAMES_PATH = 'data/frames.pickle'
 VERB_TEMPLATE = 'Verb[FORM=%s,PTRN=%d,CLS="%s",SNS="%s",FRQ=%d] -> %s'
 CV_TEMPLATE = 'CV[PTRN=%d,NUM=?n,PER=?p,TENS=?t]'
 VP_TEMPLATE = 'VP[NUM=?n,PER=?p,TENS=?t] -> %s'
@@ -195,6 +196,20 @@ def WriteRules(rules_file, patterns_file):
     rules_file.write('\n')
 
 
+def WriteFrames(patterns_path):
+  # Imported here since the rules module loads the patterns written by
+  # WriteRules.
+  import drt.rules
+
+  drt.rules.ReloadPatterns(patterns_path)
+  frames = {}
+  for index, _, classes in drt.rules._patterns:
+    for cls, frame_ids in classes.items():
+      frames[cls, index] = drt.rules.MakeVerbFrame(cls, min(frame_ids))
+
+  pickle.dump(frames, open(FRAMES_PATH, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+
 HANDLERS = {
   'LEX': HandleLex,
   'PREP': HandlePrep,
@@ -1,8 +1,25 @@
+import anydbm
+import collections
+import cPickle as pickle
+import hashlib
+import heapq
+import operator
 import os
+import shelve
+import threading
+import weakref
 import nltk
 
 
 GRAMMAR = 'grammar.fcfg'
+# The structural rules compiled from GRAMMAR, and a shelve of its lexical
+# productions keyed by their first terminal. The former records the hash of
+# the source they were compiled from and both are rebuilt whenever that goes
+# stale.
+COMPILED_GRAMMAR = 'grammar.pickle'
+COMPILED_LEXICON = 'grammar.lexicon'
+# Number of words whose lexical productions are kept in memory.
+LEXICON_CACHE_SIZE = 5000
 MAX_TREES = 10000
 
 
@@ -34,20 +51,271 @@ _KNOWN_WORDS = set([
 ])
 
 _parser = None
+_parser_kwds = {}
+_lexicon = None
+# GradeTree scores by tree identity. Each entry holds a weak reference to its
+# tree to tell it apart from a later tree that reuses the id.
+_grades = {}
 
 
 class ParserError(Exception): pass
 
 
-def ReloadGrammar(path=GRAMMAR, **kwds):
-  global _parser
+class Lexicon(object):
+  # Only the structural rules stay resident. Lexical productions are read
+  # from disk the first time their word comes up and kept in a bounded LRU,
+  # so memory follows the vocabulary in use rather than all of WordNet.
+  def __init__(self, path=COMPILED_LEXICON, size=LEXICON_CACHE_SIZE):
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.store = shelve.open(path, 'r', protocol=2)
+    self.lock = threading.Lock()
+
+  def Get(self, word):
+    with self.lock:
+      productions = self.entries.pop(word, None)
+      if productions is None:
+        productions = self.store.get(word, ())
+      self.entries[word] = productions
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+      return productions
+
+  def Close(self):
+    with self.lock:
+      self.store.close()
+      self.entries.clear()
+
+
+def ReloadGrammar(path=GRAMMAR, compiled_path=COMPILED_GRAMMAR,
+                  lexicon_path=COMPILED_LEXICON, **kwds):
+  global _parser, _parser_kwds, _lexicon
+  # Compiling recreates the lexicon file, so it mustn't still be open.
+  if _lexicon is not None:
+    _lexicon.Close()
+    _lexicon = None
+  compiled = LoadCompiledGrammar(path, compiled_path)
+  if compiled is None:
+    compiled = CompileGrammar(path, compiled_path, lexicon_path)
+  try:
+    _lexicon = Lexicon(lexicon_path)
+  except anydbm.error:
+    compiled = CompileGrammar(path, compiled_path, lexicon_path)
+    _lexicon = Lexicon(lexicon_path)
+  start, structural = compiled
+  _parser_kwds = kwds
+  _parser = nltk.parse.FeatureChartParser(
+      nltk.grammar.FeatureGrammar(start, structural), **kwds)
+
+
+def IndexGrammar(grammar):
+  structural = []
+  lexicon = {}
+  for production in grammar.productions():
+    terminals = GetTerminals(production)
+    if terminals:
+      lexicon.setdefault(terminals[0], []).append(production)
+    else:
+      structural.append(production)
+  return structural, lexicon
+
+
+def GetTerminals(production):
+  return [i for i in production.rhs() if isinstance(i, basestring)]
+
+
+def GetSentenceParser(tokens):
+  # Builds a parser over the structural rules and just the productions whose
+  # terminals all occur in the sentence, multiword ones included. The full
+  # lexicon is far too large to hand to the chart parser for every sentence.
+  words = set(tokens)
+  grammar = _parser.grammar()
+  productions = list(grammar.productions())
+  for word in words:
+    for production in _lexicon.Get(word):
+      if words.issuperset(GetTerminals(production)):
+        productions.append(production)
+  grammar = nltk.grammar.FeatureGrammar(grammar.start(), productions)
+  return nltk.parse.FeatureChartParser(grammar, **_parser_kwds)
+
+
+def CompileGrammar(path=GRAMMAR, compiled_path=COMPILED_GRAMMAR,
+                   lexicon_path=COMPILED_LEXICON):
   nltk.data._resource_cache = {}
-  _parser = nltk.load_parser('file:' + os.path.abspath(path), **kwds)
+  grammar = nltk.data.load('file:' + os.path.abspath(path), cache=False)
+  structural, lexicon = IndexGrammar(grammar)
+  store = shelve.open(lexicon_path, 'n', protocol=2)
+  for word, productions in lexicon.iteritems():
+    store[word] = productions
+  store.close()
+  # Written last, so an interrupted build leaves no valid artifact behind.
+  compiled = grammar.start(), structural
+  with open(compiled_path, 'wb') as compiled_file:
+    pickle.dump(GetGrammarHash(path), compiled_file, 2)
+    pickle.dump(compiled, compiled_file, 2)
+  return compiled
 
 
-def Parse(tokens, max_trees=MAX_TREES):
+def LoadCompiledGrammar(path=GRAMMAR, compiled_path=COMPILED_GRAMMAR):
+  if not os.path.exists(compiled_path):
+    return None
+  with open(compiled_path, 'rb') as compiled_file:
+    try:
+      if pickle.load(compiled_file) != GetGrammarHash(path):
+        return None
+      return pickle.load(compiled_file)
+    except (EOFError, pickle.UnpicklingError):
+      return None
+
+
+def GetGrammarHash(path=GRAMMAR):
+  digest = hashlib.sha1()
+  with open(path, 'rb') as grammar_file:
+    for chunk in iter(lambda: grammar_file.read(1 << 20), ''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+class Forest(object):
+  # The packed parse forest of a sentence. Trees come out best first by
+  # GradeTree score, which adds up over the nodes of a tree, so the k best
+  # derivations of each edge can be built lazily from those of its children
+  # (Huang & Chiang 2005, algorithm 3). Only as many trees as are consumed
+  # ever get built.
+  def __init__(self, chart, start, max_trees=MAX_TREES):
+    self.chart = chart
+    self.max_trees = max_trees
+    self.arcs = {}
+    self.derivations = {}
+    self.candidates = {}
+    self.pushed = set()
+    self.trees = {}
+    # The root is keyed by None and has an arc to each complete parse edge.
+    roots = [i for i in chart.select(start=0, end=chart.num_leaves(),
+                                     is_complete=True)
+             if IsParseEdge(i, start)]
+    for root in roots:
+      self.Expand(root, set())
+    self.arcs[None] = [(0, (i,)) for i in roots]
+
+  def __iter__(self):
+    for rank in range(self.max_trees):
+      tree = self.GetTree(rank)
+      if tree is None:
+        break
+      yield tree
+
+  def Expand(self, edge, path):
+    # Collects the (score, children) arcs into each edge. Arcs that would
+    # make a derivation contain its own edge are dropped, as nltk does.
+    if edge in self.arcs or IsLeafEdge(edge):
+      return
+    path.add(edge)
+    arcs = []
+    for children in self.chart.child_pointer_lists(edge):
+      if path.intersection(children):
+        continue
+      labels = []
+      for child in children:
+        if IsLeafEdge(child):
+          labels.append(self.chart.leaf(child.start()))
+        else:
+          self.Expand(child, path)
+          labels.append(child.lhs())
+      arcs.append((GradeNode(edge.lhs(), labels), tuple(children)))
+    path.remove(edge)
+    self.arcs[edge] = arcs
+
+  def Count(self):
+    counts = {}
+    def CountDerivations(edge):
+      if IsLeafEdge(edge):
+        return 1
+      if edge not in counts:
+        counts[edge] = sum(reduce(operator.mul,
+                                  (CountDerivations(i) for i in children), 1)
+                           for _, children in self.arcs[edge])
+      return counts[edge]
+    return CountDerivations(None)
+
+  def GetTree(self, rank):
+    derivation = self.GetDerivation(None, rank)
+    if derivation is None:
+      return None
+    _, arc, ranks = derivation
+    return self.BuildTree(self.arcs[None][arc][1][0], ranks[0])
+
+  def BuildTree(self, edge, rank):
+    # Subtrees are built once per derivation and shared by every tree that
+    # contains them, which lets drt.rules.Evaluate memoize them by identity.
+    if IsLeafEdge(edge):
+      return self.chart.leaf(edge.start())
+    if (edge, rank) not in self.trees:
+      score, arc, ranks = self.GetDerivation(edge, rank)
+      children = self.arcs[edge][arc][1]
+      tree = nltk.Tree(
+          edge.lhs(), [self.BuildTree(i, j) for i, j in zip(children, ranks)])
+      SetGrade(tree, score)
+      self.trees[edge, rank] = tree
+    return self.trees[edge, rank]
+
+  def GetDerivation(self, edge, rank):
+    # Returns the rank-th best (score, arc index, child ranks) derivation of
+    # the edge, or None if it has fewer derivations.
+    if IsLeafEdge(edge):
+      return (0, None, ()) if rank == 0 else None
+    if edge not in self.derivations:
+      self.derivations[edge] = []
+      self.candidates[edge] = []
+      for arc in range(len(self.arcs[edge])):
+        self.PushCandidate(edge, arc, (0,) * len(self.arcs[edge][arc][1]))
+    derivations = self.derivations[edge]
+    candidates = self.candidates[edge]
+    while len(derivations) <= rank:
+      if derivations:
+        _, arc, ranks = derivations[-1]
+        for i in range(len(ranks)):
+          self.PushCandidate(edge, arc,
+                             ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:])
+      if not candidates:
+        return None
+      score, _, arc, ranks = heapq.heappop(candidates)
+      derivations.append((-score, arc, ranks))
+    return derivations[rank]
+
+  def PushCandidate(self, edge, arc, ranks):
+    if (edge, arc, ranks) in self.pushed:
+      return
+    self.pushed.add((edge, arc, ranks))
+    score, children = self.arcs[edge][arc]
+    for child, rank in zip(children, ranks):
+      derivation = self.GetDerivation(child, rank)
+      if derivation is None:
+        return
+      score += derivation[0]
+    heapq.heappush(self.candidates[edge],
+                   (-score, len(self.pushed), arc, ranks))
+
+
+def IsLeafEdge(edge):
+  return isinstance(edge, nltk.parse.chart.LeafEdge)
+
+
+def IsParseEdge(edge, start):
+  return (isinstance(edge, nltk.parse.featurechart.FeatureTreeEdge) and
+          edge.lhs()[_TYPE_FEATURE] == start[_TYPE_FEATURE] and
+          nltk.featstruct.unify(edge.lhs(), start, rename_vars=True))
+
+
+def ParseForest(tokens, max_trees=MAX_TREES):
   if _parser is None: ReloadGrammar()
-  trees = _parser.nbest_parse(tokens, max_trees)
+  parser = GetSentenceParser(tokens)
+  return Forest(parser.chart_parse(tokens), parser.grammar().start(),
+                max_trees)
+
+
+def Parse(tokens, max_trees=MAX_TREES):
+  trees = list(ParseForest(tokens, max_trees))
   if trees:
     return trees
   else:
@@ -59,28 +327,50 @@ def SelectTree(trees):
 
 
 def GradeTree(tree):
+  # Trees are treated as immutable once graded. Shared subtrees are only
+  # walked once, and trees from a Forest come with their scores.
   if isinstance(tree, basestring):
     return 0
-  else:
-    score = 0
-    
-    # Prefer Ss and VPs that directly contain prepositions. For matching
-    # phrasal verbs like "switch _ on" and objects like "give _ to _".
-    if tree.node[_TYPE_FEATURE] in ('S', 'VP'):
-      score = (sum(2000 for i in tree if isinstance(i, basestring)) +
-               sum(1000 for i in tree
-                   if hasattr(i, 'node') and i.node[_TYPE_FEATURE] == 'Prep'))
-
-    # Terminals used in the manual rules take precendence.
-    if (len(tree) == 1 and
-        isinstance(tree[0], basestring) and
-        tree[0] in _KNOWN_WORDS and
-        tree.node[_TYPE_FEATURE] in ('Noun', 'Adj', 'Verb')):
-      score -= 500
-
-    # Ambiguous names are less likely to come as proper nouns.
-    # Nouns that have been observed by the wordnet frequency counter are better.
-    if 'FRQ' in tree.node:
-      score += tree.node['FRQ']
-
-    return sum(GradeTree(i) for i in tree) + score
+  entry = _grades.get(id(tree))
+  if entry is not None and entry[0]() is tree:
+    return entry[1]
+  children = [i if isinstance(i, basestring) else i.node for i in tree]
+  score = sum(GradeTree(i) for i in tree) + GradeNode(tree.node, children)
+  SetGrade(tree, score)
+  return score
+
+
+def SetGrade(tree, score):
+  key = id(tree)
+  def Forget(reference):
+    if _grades.get(key, (None,))[0] is reference:
+      del _grades[key]
+  _grades[key] = (weakref.ref(tree, Forget), score)
+
+
+def GradeNode(node, children):
+  # Scores a single node given its children, which are terminal strings or
+  # the nodes of subtrees.
+  score = 0
+
+  # Prefer Ss and VPs that directly contain prepositions. For matching
+  # phrasal verbs like "switch _ on" and objects like "give _ to _".
+  if node[_TYPE_FEATURE] in ('S', 'VP'):
+    score = (sum(2000 for i in children if isinstance(i, basestring)) +
+             sum(1000 for i in children
+                 if not isinstance(i, basestring) and
+                    i[_TYPE_FEATURE] == 'Prep'))
+
+  # Terminals used in the manual rules take precendence.
+  if (len(children) == 1 and
+      isinstance(children[0], basestring) and
+      children[0] in _KNOWN_WORDS and
+      node[_TYPE_FEATURE] in ('Noun', 'Adj', 'Verb')):
+    score -= 500
+
+  # Ambiguous names are less likely to come as proper nouns.
+  # Nouns that have been observed by the wordnet frequency counter are better.
+  if 'FRQ' in node:
+    score += node['FRQ']
+
+  return score
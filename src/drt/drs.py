@@ -1,5 +1,6 @@
 import collections
 import copy
+import itertools
 import re
 
 
@@ -11,16 +12,33 @@ SINGULAR_TYPE = 's'
 PLURAL_TYPE = 'p'
 MASS_TYPE = 'm'
 
+# Characters Prover9 doesn't accept in symbols, replaced by '__'.
+SYMBOL_REGEX = re.compile('[\'"/-]')
+
+
+# Symbol names already made safe for the prover, by name.
+_symbols = {}
+
+
+def FormulateSymbol(name):
+  symbol = _symbols.get(name)
+  if symbol is None:
+    symbol = _symbols[name] = SYMBOL_REGEX.sub('__', name.replace('.', '_'))
+  return symbol
+
 
 class Referent(object):
-  ref_index = 1
+  __slots__ = ('type', 'index')
+
+  # A shared counter, so that referents created by concurrent evaluations
+  # never get the same index.
+  ref_index = itertools.count(1)
   
   def __init__(self, type=SINGULAR_TYPE):
     # Prover9 treats u-z as vars, not consts as we want them.
     assert type not in ('u', 'v', 'w', 'x', 'y', 'z')
     self.type = type
-    self.index = self.__class__.ref_index
-    self.__class__.ref_index += 1
+    self.index = self.__class__.ref_index.next()
 
   def __repr__(self):
     return self.id
@@ -31,6 +49,7 @@ class Referent(object):
 
 
 class NamedReferent(Referent):
+  __slots__ = ('name',)
 
   def __init__(self, name):
     self.type = SINGULAR_TYPE
@@ -54,6 +73,13 @@ class NamedReferent(Referent):
 
 
 class Condition(object):
+  # Slotted, as every noun and verb brings dozens of hypernym conditions.
+  __slots__ = ('parent', 'informative')
+
+  # Shared conditions are never changed once created, so boxes and their
+  # copies can hold the same instance. They don't track their parent.
+  shared = False
+
   def __ne__(self, other):
     return not (self == other)
 
@@ -67,16 +93,41 @@ class Condition(object):
   def GetChildDRSs(self):
     return ()
 
+  def GetReferents(self):
+    # The referents the condition itself mentions, excluding child boxes.
+    return ()
+
+  def GetShape(self):
+    # A hash equal for equal conditions. Unlike __hash__, it leaves out the
+    # referents of child boxes, which are changed without the boxes knowing.
+    return hash(self)
+
   def GetAccessibleReferents(self, _=None):
     return self.parent.GetAccessibleReferents()
 
 
 class PredicateCondition(Condition):
+  __slots__ = ('predicate', 'args', '_formula')
+  shared = True
+
   def __init__(self, predicate, *args, **kwds):
+    # The same few thousand synset names are shared by most conditions.
+    if isinstance(predicate, str):
+      predicate = intern(predicate)
     self.predicate = predicate
     self.args = args
     self.parent = None
     self.informative = kwds.get('informative', True)
+    self._formula = None
+
+  def __getstate__(self):
+    # The formula names the referents, which copies may swap.
+    return (self.predicate, self.args, self.informative)
+
+  def __setstate__(self, state):
+    self.predicate, self.args, self.informative = state
+    self.parent = None
+    self._formula = None
 
   def __repr__(self):
     args = ', '.join(str(i) for i in self.args)
@@ -91,22 +142,45 @@ class PredicateCondition(Condition):
     return hash((PredicateCondition, self.predicate, self.args))
 
   def Formulate(self):
-    return re.sub('[\'"/-]', '__', repr(self).replace('.', '_'))
+    # Shared conditions never change, so the formula is worked out once.
+    if self._formula is None:
+      args = ', '.join(FormulateSymbol(i.id) if isinstance(i, NamedReferent)
+                       else i.id for i in self.args)
+      self._formula = '%s(%s)' % (FormulateSymbol(self.predicate), args)
+    return self._formula
 
-  def ReplaceReferent(self, old, new, add_new):
-    new_args = []
-    for arg in self.args:
-      new_args.append(new if arg == old else arg)
-    self.args = tuple(new_args)
-    return add_new
+  def Copy(self):
+    return self
+
+  def GetReferents(self):
+    return self.args
+
+  def Substitute(self, old, new):
+    if old not in self.args:
+      return self
+    args = tuple(new if i == old else i for i in self.args)
+    return PredicateCondition(self.predicate, *args,
+                              informative=self.informative)
 
 
 class EqualityCondition(Condition):
+  __slots__ = ('ref1', 'ref2', '_formula')
+  shared = True
+
   def __init__(self, referent1, referent2, informative=True):
     self.ref1 = referent1
     self.ref2 = referent2
     self.parent = None
     self.informative = informative
+    self._formula = None
+
+  def __getstate__(self):
+    return (self.ref1, self.ref2, self.informative)
+
+  def __setstate__(self, state):
+    self.ref1, self.ref2, self.informative = state
+    self.parent = None
+    self._formula = None
 
   def __repr__(self):
     return '(%s = %s)' % (self.ref1, self.ref2)
@@ -117,18 +191,30 @@ class EqualityCondition(Condition):
              (self.ref1 == other.ref2 and self.ref2 == other.ref1)))
 
   def __hash__(self):
-    return hash((EqualityCondition, self.ref1, self.ref2))
+    return hash((EqualityCondition, frozenset((self.ref1, self.ref2))))
 
   def Formulate(self):
-    return str(self)
+    if self._formula is None:
+      self._formula = str(self)
+    return self._formula
 
-  def ReplaceReferent(self, old, new, add_new):
-    if self.ref1 == old: self.ref1 = new
-    if self.ref2 == old: self.ref2 = new
-    return add_new
+  def Copy(self):
+    return self
+
+  def GetReferents(self):
+    return (self.ref1, self.ref2)
+
+  def Substitute(self, old, new):
+    if self.ref1 != old and self.ref2 != old:
+      return self
+    return EqualityCondition(new if self.ref1 == old else self.ref1,
+                             new if self.ref2 == old else self.ref2,
+                             informative=self.informative)
 
 
 class NegationCondition(Condition):
+  __slots__ = ('drs',)
+
   def __init__(self, drs_or_condition, informative=True):
     if isinstance(drs_or_condition, Condition):
       drs_or_condition = DRS([], [drs_or_condition])
@@ -147,6 +233,9 @@ class NegationCondition(Condition):
   def __hash__(self):
     return hash((NegationCondition, self.drs))
 
+  def GetShape(self):
+    return hash((NegationCondition, self.drs.GetShape()))
+
   @property
   def summary(self):
     return '-%s' % self.drs.summary
@@ -165,6 +254,8 @@ class NegationCondition(Condition):
 
 
 class AlternationCondition(Condition):
+  __slots__ = ('drs1', 'drs2')
+
   def __init__(self, drs_or_condition1, drs_or_condition2, informative=True):
     if isinstance(drs_or_condition1, Condition):
       drs_or_condition1 = DRS([], [drs_or_condition1])
@@ -186,7 +277,11 @@ class AlternationCondition(Condition):
              (self.drs1 == other.drs2 and self.drs2 == other.drs1)))
 
   def __hash__(self):
-    return hash((AlternationCondition, self.drs1, self.drs2))
+    return hash((AlternationCondition, frozenset((self.drs1, self.drs2))))
+
+  def GetShape(self):
+    return hash((AlternationCondition,
+                 frozenset((self.drs1.GetShape(), self.drs2.GetShape()))))
 
   @property
   def summary(self):
@@ -210,6 +305,8 @@ class AlternationCondition(Condition):
 
 
 class ImplicationCondition(Condition):
+  __slots__ = ('drs1', 'drs2')
+
   def __init__(self, drs_or_condition1, drs_or_condition2, informative=True):
     if isinstance(drs_or_condition1, Condition):
       drs_or_condition1 = DRS([], [drs_or_condition1])
@@ -233,6 +330,10 @@ class ImplicationCondition(Condition):
   def __hash__(self):
     return hash((ImplicationCondition, self.drs1, self.drs2))
 
+  def GetShape(self):
+    return hash((ImplicationCondition, self.drs1.GetShape(),
+                 self.drs2.GetShape()))
+
   @property
   def summary(self):
     return '(%s -> %s)' % (self.drs1.summary, self.drs2.summary)
@@ -262,6 +363,8 @@ class ImplicationCondition(Condition):
 
 
 class ResolutionCondition(Condition):
+  __slots__ = ('ref', 'requirements', 'type')
+
   def __init__(self, referent, requirements, type):
     self.ref = referent
     self.requirements = requirements
@@ -280,7 +383,7 @@ class ResolutionCondition(Condition):
     return isinstance(other, self.__class__) and self.ref == other.ref
 
   def __hash__(self):
-    return hash((ResolutionCondition, self.ref, self.requirements))
+    return hash((ResolutionCondition, self.ref))
 
   @property
   def summary(self):
@@ -295,6 +398,9 @@ class ResolutionCondition(Condition):
   def Formulate(self):
     raise FormulationError('Cannot formulate unresolved condition.')
 
+  def GetReferents(self):
+    return (self.ref,)
+
   def GetChildDRSs(self):
     return (self.requirements,)
 
@@ -307,27 +413,48 @@ class ResolutionCondition(Condition):
 
 
 class DRS(object):
+  # The target is only set on SubjectQuestionDRS, but the question classes
+  # add no slots of their own so that __iadd__ can switch a box's class.
+  __slots__ = ('_conditions', '_positions', '_mentions', '_removed',
+               '_shapes', '_by_shape', '_stale', '_shape', '_literals',
+               'referents', 'parent', 'target')
+
   def __init__(self, referents=(), conditions=(), parent=None):
     if isinstance(referents, DRS):
       DRS.__init__(self)
       self += referents
     else:
-      self._conditions = []
-      for cond in conditions:
-        self.AddCondition(cond)
+      self._Clear()
       self.referents = set(referents)
       self.parent = parent
+      for cond in conditions:
+        self.AddCondition(cond)
+
+  def __getstate__(self):
+    # Some conditions are keyed by identity, so copies rebuild the store.
+    return (self.referents, self.parent, self.conditions,
+            getattr(self, 'target', None))
+
+  def __setstate__(self, state):
+    self.referents, self.parent, conditions, target = state
+    self._Clear()
+    for cond in conditions:
+      self._Store(cond)
+    if target is not None:
+      self.target = target
 
   def __nonzero__(self):
-    return bool(self.referents or self._conditions)
+    return bool(self.referents or self._positions)
 
   def __add__(self, other):
     base = self.Copy()
     return base.__iadd__(other)
 
   def __iadd__(self, other):
-    self.referents.update(other.referents)
-    for cond in other._conditions:
+    if not self.referents.issuperset(other.referents):
+      self.referents.update(other.referents)
+      self._Touch()
+    for cond in other.conditions:
       self.AddCondition(cond.Copy())
     if isinstance(other, SubjectQuestionDRS):
       self.__class__ = SubjectQuestionDRS
@@ -336,17 +463,17 @@ class DRS(object):
 
   def __repr__(self):
     refs = ', '.join(str(i) for i in self.referents)
-    conds = ', '.join(str(i) for i in self._conditions)
+    conds = ', '.join(str(i) for i in self.conditions)
     if refs:
       result = '[%s | %s]' % (refs, conds)
     else:
-      result = conds if len(self._conditions) == 1 else '[%s]' % conds
+      result = conds if len(self._positions) == 1 else '[%s]' % conds
     return result
 
   def __eq__(self, other):
     return (isinstance(other, self.__class__) and
             self.referents == other.referents and
-            self._conditions == other._conditions)
+            self.conditions == other.conditions)
 
   def __ne__(self, other):
     return not (self == other)
@@ -354,49 +481,234 @@ class DRS(object):
   def __hash__(self):
     return hash((DRS,
                  frozenset(self.referents),
-                 frozenset(self._conditions)))
+                 frozenset(self.conditions)))
 
   @property
   def summary(self):
     refs = ', '.join(str(i) for i in self.referents)
-    informative_conds = [i for i in self._conditions if i.informative]
+    informative_conds = [i for i in self.conditions if i.informative]
     conds = ', '.join(i.summary for i in informative_conds)
     if refs:
       result = '[%s | %s]' % (refs, conds)
     else:
-      result = conds if len(self._conditions) == 1 else '[%s]' % conds
+      result = conds if len(self._positions) == 1 else '[%s]' % conds
       result = conds if len(informative_conds) == 1 else '[%s]' % conds
     return result
 
   @property
   def conditions(self):
-    return tuple(self._conditions)
+    return tuple(i for i in self._conditions if i is not None)
+
+  def GetMentions(self, ref):
+    # Returns the shared conditions of the box that mention the referent, in
+    # order.
+    mentions = self._GetMentionIndex().get(ref, ())
+    positions = sorted(self._positions[i] for i in mentions)
+    return tuple(self._conditions[i] for i in positions)
+
+  def GetUnaryLiterals(self):
+    # Maps referents to the sets of one-place predicates the box asserts and
+    # denies of them. For alternations, such as the hypernym paths from
+    # rules.GetHypernymConditions, only what both sides agree on counts. The
+    # result is kept until the box or a box under it changes, and mustn't be
+    # modified.
+    if self._literals is not None:
+      return self._literals
+    literals = collections.defaultdict(lambda: (set(), set()))
+    for cond in self.conditions:
+      if isinstance(cond, PredicateCondition) and len(cond.args) == 1:
+        literals[cond.args[0]][0].add(cond.predicate)
+      elif isinstance(cond, NegationCondition):
+        negated = cond.drs.conditions
+        if (not cond.drs.referents and len(negated) == 1 and
+            isinstance(negated[0], PredicateCondition) and
+            len(negated[0].args) == 1):
+          literals[negated[0].args[0]][1].add(negated[0].predicate)
+      elif isinstance(cond, AlternationCondition):
+        left = cond.drs1.GetUnaryLiterals()
+        right = cond.drs2.GetUnaryLiterals()
+        local = cond.drs1.referents | cond.drs2.referents
+        for referent in set(left).intersection(right).difference(local):
+          literals[referent][0].update(left[referent][0] & right[referent][0])
+          literals[referent][1].update(left[referent][1] & right[referent][1])
+    self._literals = dict(literals)
+    return self._literals
+
+  def FindCondition(self, cond):
+    # Returns the condition of the box equal to the given one, if any.
+    if cond.shared:
+      position = self._positions.get(cond)
+      return None if position is None else self._conditions[position]
+    self._Reshape()
+    if self._by_shape is None:
+      return None
+    matches = [i for i in self._by_shape.get(cond.GetShape(), {}).itervalues()
+               if i == cond]
+    if not matches:
+      return None
+    return min(matches, key=lambda i: self._positions[id(i)])
+
+  def GetShape(self):
+    if self._shape is None:
+      self._Reshape()
+      self._shape = hash(frozenset(self._shapes[id(i)] if not i.shared
+                                   else hash(i) for i in self.conditions))
+    return self._shape
 
   def AddCondition(self, cond):
     assert isinstance(cond, Condition)
-    if cond in self._conditions:
-      if cond.informative:
-        self._conditions.remove(cond)
-        self._conditions.append(cond)
-    else:
+    existing = self.FindCondition(cond)
+    if existing is not None:
+      if not cond.informative:
+        return
+      self._Discard(existing)
+    if not cond.shared:
       cond.parent = self
-      self._conditions.append(cond)
+    self._Store(cond)
+    self._Touch()
 
   def RemoveCondition(self, cond):
-    if cond in self._conditions:
-      self._conditions.remove(cond)
+    existing = self.FindCondition(cond)
+    if existing is not None:
+      self._Discard(existing)
+      self._Touch()
+
+  def _Clear(self):
+    # Conditions are kept in order, with None left where one was removed
+    # until those outnumber the rest. Shared conditions are indexed by
+    # themselves, and by the referents they mention once that is first asked
+    # for. The others can change under the box, so they are indexed by
+    # identity, and by their shape as of when it was last worked out. Changes
+    # to their boxes mark them stale in the box holding them, and the stale
+    # ones are reshaped on lookup. Most boxes are small and never searched,
+    # so these indices are only made on first use.
+    self._conditions = []
+    self._positions = {}
+    self._mentions = None
+    self._removed = 0
+    self._shapes = None
+    self._by_shape = None
+    self._stale = None
+    self._shape = None
+    self._literals = None
+
+  def _GetKey(self, cond):
+    return cond if cond.shared else id(cond)
+
+  def _Store(self, cond, position=None):
+    # A position given must have been left empty by _Discard.
+    if position is None:
+      position = len(self._conditions)
+      self._conditions.append(cond)
+    else:
+      self._conditions[position] = cond
+      self._removed -= 1
+    self._positions[self._GetKey(cond)] = position
+    if cond.shared:
+      if self._mentions is not None:
+        for ref in cond.GetReferents():
+          self._mentions.setdefault(ref, set()).add(cond)
+    elif self._stale is not None:
+      self._stale.add(id(cond))
+    self._shape = None
+    self._literals = None
+
+  def _Discard(self, cond, compact=True):
+    # Returns the position the condition was at.
+    position = self._positions.pop(self._GetKey(cond))
+    self._conditions[position] = None
+    if cond.shared:
+      if self._mentions is not None:
+        for ref in cond.GetReferents():
+          mentions = self._mentions.get(ref)
+          if mentions is not None:
+            mentions.discard(cond)
+            if not mentions:
+              del self._mentions[ref]
+    elif self._stale is not None:
+      self._stale.discard(id(cond))
+      self._Unshape(id(cond))
+    self._shape = None
+    self._literals = None
+
+    self._removed += 1
+    if compact and self._removed > len(self._positions):
+      self._conditions = [i for i in self._conditions if i is not None]
+      for index, cond in enumerate(self._conditions):
+        self._positions[self._GetKey(cond)] = index
+      self._removed = 0
+    return position
+
+  def _GetMentionIndex(self):
+    if self._mentions is None:
+      self._mentions = {}
+      for cond in self._conditions:
+        if cond is not None and cond.shared:
+          for ref in cond.GetReferents():
+            self._mentions.setdefault(ref, set()).add(cond)
+    return self._mentions
+
+  def _GetComplex(self):
+    return [i for i in self._conditions if i is not None and not i.shared]
+
+  def _Unshape(self, key):
+    shape = self._shapes.pop(key, None)
+    if shape is not None:
+      conds = self._by_shape[shape]
+      del conds[key]
+      if not conds:
+        del self._by_shape[shape]
+
+  def _Reshape(self):
+    if self._stale is None:
+      complex = self._GetComplex()
+      if not complex:
+        return
+      self._shapes = {}
+      self._by_shape = {}
+      self._stale = set(id(i) for i in complex)
+    for key in self._stale:
+      self._Unshape(key)
+      cond = self._conditions[self._positions[key]]
+      shape = self._shapes[key] = cond.GetShape()
+      self._by_shape.setdefault(shape, {})[key] = cond
+    self._stale.clear()
+
+  def _Touch(self):
+    # Marks the conditions holding this box as stale in the boxes above.
+    self._literals = None
+    # Copies keep the parent of their original without belonging to it, so
+    # the walk stops at the first box its parent doesn't hold.
+    drs = self
+    while drs.parent is not None and drs.parent.parent is not None:
+      cond = drs.parent
+      if not any(i is drs for i in cond.GetChildDRSs()):
+        break
+      drs = cond.parent
+      if id(cond) not in drs._positions:
+        break
+      if drs._stale is not None:
+        drs._stale.add(id(cond))
+      drs._shape = None
+      drs._literals = None
 
   def Copy(self):
-    return self.__class__(self.referents,
-                          (i.Copy() for i in self._conditions),
-                          self.parent)
+    # The conditions of a box are already distinct, so the copies are
+    # stored without looking for duplicates.
+    result = self.__class__(self.referents, (), self.parent)
+    for cond in self.conditions:
+      cond = cond.Copy()
+      if not cond.shared:
+        cond.parent = result
+      result._Store(cond)
+    return result
 
   def GetChildDRSs(self):
-    return sum((i.GetChildDRSs() for i in self._conditions), ())
+    return sum((i.GetChildDRSs() for i in self._GetComplex()), ())
 
   def Walk(self):
     yield self
-    for cond in self._conditions:
+    for cond in self._GetComplex():
       for drs in cond.GetChildDRSs():
         for drs2 in drs.Walk():
           yield drs2
@@ -410,7 +722,7 @@ class DRS(object):
     return ' '.join('%s %s' % (scope, i) for i in self.referents)
 
   def FormulateConditions(self, enforce_unique=True):
-    conds = [i.Formulate() for i in self._conditions]
+    conds = [i.Formulate() for i in self.conditions]
     uniqueness = []
     if enforce_unique:
       referents = list(self.referents)
@@ -425,6 +737,8 @@ class DRS(object):
   def ReplaceReferent(self, old, new, add_new=False):
     assert not (isinstance(old, NamedReferent) and
                 not isinstance(new, NamedReferent))
+    if old in self.referents or new in self.referents:
+      self._Touch()
     if new in self.referents and not add_new:
       self.referents.remove(new)
 
@@ -434,9 +748,34 @@ class DRS(object):
         self.referents.add(new)
         add_new = False
 
-    add_new = all([cond.ReplaceReferent(old, new, add_new)
-                   for cond in self._conditions])
-    return add_new
+    # Only the shared conditions mentioning the referent are swapped, each
+    # in its place. Conditions made equal by the replacement are merged
+    # where the first one was, keeping the informative one.
+    mentions = self._GetMentionIndex().get(old, ())
+    if mentions:
+      self._Touch()
+    for position in sorted(self._positions[i] for i in mentions):
+      cond = self._conditions[position]
+      self._Discard(cond, compact=False)
+      cond = cond.Substitute(old, new)
+      existing = self.FindCondition(cond)
+      if existing is None:
+        self._Store(cond, position)
+        continue
+      existing_position = self._Discard(existing, compact=False)
+      first, second = sorted([(position, cond),
+                              (existing_position, existing)])
+      if second[1].informative and not first[1].informative:
+        self._Store(second[1], first[0])
+      else:
+        self._Store(first[1], first[0])
+
+    # Complex conditions are always visited, as their boxes may mention it.
+    complex = self._GetComplex()
+    results = [i.ReplaceReferent(old, new, add_new) for i in complex]
+    if len(self._positions) > len(complex):
+      results.append(add_new)
+    return all(results)
 
   def GetAccessibleReferents(self):
     refs = collections.OrderedDict((i, self) for i in self.referents)
@@ -447,27 +786,33 @@ class DRS(object):
     return refs
 
   def Simplify(self):
+    # Replacing a referent swaps out the conditions mentioning it, so the
+    # equalities are read through the replacements made so far.
+    replaced = {}
+    def GetCurrent(ref):
+      while ref in replaced:
+        ref = replaced[ref]
+      return ref
+
     boxes_to_resolve = [self]
-    resolved_referents = {}
     while boxes_to_resolve:
       drs = boxes_to_resolve.pop()
       for cond in drs.conditions:
         if isinstance(cond, EqualityCondition):
-          if cond.ref1 in resolved_referents:
-            cond.ref1 = resolved_referents[cond.ref1]
-          if cond.ref2 in resolved_referents:
-            cond.ref2 = resolved_referents[cond.ref2]
-          if cond.ref1 != cond.ref2:
-            if isinstance(cond.ref1, NamedReferent):
-              self.ReplaceReferent(cond.ref2, cond.ref1, add_new=True)
+          ref1, ref2 = GetCurrent(cond.ref1), GetCurrent(cond.ref2)
+          if ref1 != ref2:
+            if isinstance(ref1, NamedReferent):
+              self.ReplaceReferent(ref2, ref1, add_new=True)
+              replaced[ref2] = ref1
             else:
-              self.ReplaceReferent(cond.ref1, cond.ref2, add_new=True)
-            resolved_referents[cond.ref1] = cond.ref2
-          drs.RemoveCondition(cond)
+              self.ReplaceReferent(ref1, ref2, add_new=True)
+              replaced[ref1] = ref2
+          drs.RemoveCondition(EqualityCondition(GetCurrent(ref1),
+                                                GetCurrent(ref2)))
         if not isinstance(cond, NegationCondition):
           boxes_to_resolve += cond.GetChildDRSs()
-    conditions = self._conditions
-    self._conditions = []
+    conditions = self.conditions
+    self._Clear()
     for cond in conditions:
       self.AddCondition(cond)
 
@@ -481,7 +826,9 @@ class DRS(object):
           named_refs.add(ref)
         else:
           refs_to_keep.add(ref)
-      drs.referents = refs_to_keep
+      if refs_to_keep != drs.referents:
+        drs.referents = refs_to_keep
+        drs._Touch()
 
     self.referents.update(named_refs)
 
@@ -494,10 +841,12 @@ class DRS(object):
 
 
 class QuestionDRS(DRS):
-  pass
+  __slots__ = ()
 
 
 class BooleanQuestionDRS(QuestionDRS):
+  __slots__ = ()
+
   def __repr__(self):
     return 'Yes/No Question: ' + DRS.__repr__(self)
 
@@ -507,6 +856,8 @@ class BooleanQuestionDRS(QuestionDRS):
 
 
 class SubjectQuestionDRS(QuestionDRS):
+  __slots__ = ()
+
   def __init__(self, drs, target):
     self.target = target
     DRS.__init__(self, drs)
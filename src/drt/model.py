@@ -0,0 +1,257 @@
+import itertools
+from drs import *
+
+
+# Work limits for the in-process model search. Past them the search gives up
+# and the caller falls back to Mace4.
+MAX_GROUNDINGS = 20000
+MAX_STEPS = 20000
+
+
+class SearchError(Exception): pass
+
+
+def IsSatisfiable(drs, domain_size, refuted=None, max_steps=MAX_STEPS):
+  # Looks for a model of exactly domain_size elements that satisfies the DRS
+  # (as formulated by DRS.Formulate()) and, if given, falsifies the refuted
+  # DRS (as formulated by Formulate(enforce_unique=False)). This is the
+  # question Mace4 answers for GetConsistencyQuery and GetProofQueries.
+  # Returns True or False, or None if the search gave up.
+  try:
+    return Search(drs, domain_size, refuted, max_steps)
+  except SearchError:
+    return None
+
+
+def Search(drs, domain_size, refuted, max_steps):
+  roots = sorted(i.id for i in drs.referents)
+  if len(roots) > domain_size:
+    return False
+  bound = frozenset(roots)
+  free = GetFreeReferents(drs, bound)
+  if refuted is not None:
+    free |= GetFreeReferents(refuted, bound)
+  free = sorted(free - bound)
+
+  # Elements are interchangeable, so the root referents can take the first
+  # elements and each free constant either an element already in use or the
+  # next unused one.
+  budget = [MAX_GROUNDINGS, max_steps]
+  for values in AssignFree(len(free), len(roots), domain_size):
+    binding = dict(zip(roots, range(len(roots))))
+    binding.update(zip(free, values))
+    formula = MakeAnd([GroundConditions(drs, binding, True, domain_size,
+                                        budget)])
+    if refuted is not None:
+      negation = GroundBox(refuted, binding, False, False, domain_size, budget)
+      formula = MakeAnd([formula, negation])
+    if Solve(formula, budget):
+      return True
+  return False
+
+
+def AssignFree(count, used, domain_size):
+  if count == 0:
+    yield ()
+    return
+  for value in range(min(used + 1, domain_size)):
+    for rest in AssignFree(count - 1, max(used, value + 1), domain_size):
+      yield (value,) + rest
+
+
+def GetFreeReferents(drs, bound):
+  bound = bound | frozenset(i.id for i in drs.referents)
+  free = set()
+  for cond in drs.conditions:
+    if isinstance(cond, PredicateCondition):
+      free.update(i.id for i in cond.args)
+    elif isinstance(cond, EqualityCondition):
+      free.update((cond.ref1.id, cond.ref2.id))
+    elif isinstance(cond, ImplicationCondition):
+      free |= GetFreeReferents(cond.drs1, bound)
+      inner = bound | frozenset(i.id for i in cond.drs1.referents)
+      free |= GetFreeReferents(cond.drs2, inner)
+    elif isinstance(cond, (NegationCondition, AlternationCondition)):
+      for child in cond.GetChildDRSs():
+        free |= GetFreeReferents(child, bound)
+    else:
+      raise SearchError('Unsupported condition: %s' % cond)
+  return free - bound
+
+
+def Assign(referents, binding, unique, domain_size, budget):
+  # Yields the bindings extending the given one over the referents of a box.
+  ids = sorted(i.id for i in referents)
+  if unique:
+    values = itertools.permutations(range(domain_size), len(ids))
+  else:
+    values = itertools.product(range(domain_size), repeat=len(ids))
+  for value in values:
+    budget[0] -= 1
+    if budget[0] < 0:
+      raise SearchError('Too many groundings.')
+    extended = dict(binding)
+    extended.update(zip(ids, value))
+    yield extended
+
+
+def GroundBox(drs, binding, positive, unique, domain_size, budget):
+  # The existential closure of the box, or its negation if not positive.
+  instances = []
+  for extended in Assign(drs.referents, binding, unique, domain_size, budget):
+    instances.append(GroundConditions(drs, extended, positive, domain_size,
+                                      budget))
+  if positive:
+    return MakeOr(instances)
+  else:
+    return MakeAnd(instances)
+
+
+def GroundConditions(drs, binding, positive, domain_size, budget):
+  literals = [GroundCondition(i, binding, positive, domain_size, budget)
+              for i in drs.conditions]
+  if positive:
+    return MakeAnd(literals)
+  else:
+    return MakeOr(literals)
+
+
+def GroundCondition(cond, binding, positive, domain_size, budget):
+  if isinstance(cond, PredicateCondition):
+    atom = (cond.predicate,) + tuple(binding[i.id] for i in cond.args)
+    return ('atom', atom, positive)
+  elif isinstance(cond, EqualityCondition):
+    return (binding[cond.ref1.id] == binding[cond.ref2.id]) == positive
+  elif isinstance(cond, NegationCondition):
+    return GroundBox(cond.drs, binding, not positive, True, domain_size,
+                     budget)
+  elif isinstance(cond, AlternationCondition):
+    sides = [GroundBox(i, binding, positive, True, domain_size, budget)
+             for i in (cond.drs1, cond.drs2)]
+    return MakeOr(sides) if positive else MakeAnd(sides)
+  elif isinstance(cond, ImplicationCondition):
+    # Assignments that break the antecedent's uniqueness make it false, so
+    # only the injective ones matter.
+    instances = []
+    for extended in Assign(cond.drs1.referents, binding, True, domain_size,
+                           budget):
+      antecedent = GroundConditions(cond.drs1, extended, not positive,
+                                    domain_size, budget)
+      consequent = GroundBox(cond.drs2, extended, positive, True,
+                             domain_size, budget)
+      if positive:
+        instances.append(MakeOr([antecedent, consequent]))
+      else:
+        instances.append(MakeAnd([antecedent, consequent]))
+    return MakeAnd(instances) if positive else MakeOr(instances)
+  else:
+    raise SearchError('Unsupported condition: %s' % cond)
+
+
+def MakeAnd(formulas):
+  parts = []
+  for formula in formulas:
+    if formula is False:
+      return False
+    elif formula is True:
+      continue
+    elif formula[0] == 'and':
+      parts.extend(formula[1])
+    else:
+      parts.append(formula)
+  if not parts:
+    return True
+  return parts[0] if len(parts) == 1 else ('and', tuple(parts))
+
+
+def MakeOr(formulas):
+  parts = []
+  for formula in formulas:
+    if formula is True:
+      return True
+    elif formula is False:
+      continue
+    elif formula[0] == 'or':
+      parts.extend(formula[1])
+    else:
+      parts.append(formula)
+  if not parts:
+    return False
+  return parts[0] if len(parts) == 1 else ('or', tuple(parts))
+
+
+def Evaluate(formula, assignment):
+  # Returns the value of the formula under a partial assignment, or None if
+  # it is not settled yet.
+  if formula is True or formula is False:
+    return formula
+  kind = formula[0]
+  if kind == 'atom':
+    value = assignment.get(formula[1])
+    return None if value is None else value == formula[2]
+  settled = kind == 'or'
+  result = not settled
+  for part in formula[1]:
+    value = Evaluate(part, assignment)
+    if value is settled:
+      return settled
+    elif value is None:
+      result = None
+  return result
+
+
+def Solve(formula, budget):
+  # A tableau search over the grounded formula, which is in negation normal
+  # form: atoms are assigned as they come up and disjunctions branched on,
+  # smallest first.
+  stack = [({}, [formula])]
+  while stack:
+    assignment, todo = stack.pop()
+    disjunctions = []
+    consistent = True
+    while todo and consistent:
+      budget[1] -= 1
+      if budget[1] < 0:
+        raise SearchError('Too many steps.')
+      formula = todo.pop()
+      if formula is True:
+        continue
+      elif formula is False:
+        consistent = False
+      elif formula[0] == 'atom':
+        value = assignment.setdefault(formula[1], formula[2])
+        consistent = value == formula[2]
+      elif formula[0] == 'and':
+        todo.extend(formula[1])
+      else:
+        disjunctions.append(formula)
+    if not consistent:
+      continue
+
+    pending = []
+    for disjunction in disjunctions:
+      budget[1] -= len(disjunction[1])
+      options = []
+      for part in disjunction[1]:
+        value = Evaluate(part, assignment)
+        if value:
+          options = None
+          break
+        elif value is None:
+          options.append(part)
+      if options is None:
+        continue
+      elif not options:
+        consistent = False
+        break
+      pending.append(options)
+    if not consistent:
+      continue
+    if not pending:
+      return True
+
+    options = min(pending, key=len)
+    rest = [('or', tuple(i)) for i in pending if i is not options]
+    for option in reversed(options):
+      stack.append((dict(assignment), rest + [option]))
+  return False
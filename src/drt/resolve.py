@@ -1,13 +1,37 @@
+import multiprocessing
+import Queue
+import sys
+import threading
 import logic
 from drs import *
 
 
+# Number of antecedent candidates checked concurrently.
+PARALLEL_CANDIDATES = multiprocessing.cpu_count()
+NO_LITERALS = (frozenset(), frozenset())
+
+
 class ConsistencyError(Exception): pass
 class ResolutionError(ConsistencyError): pass
 class AccommodationError(ResolutionError): pass
+# Raised when the prover ran out of budget before deciding a resolution.
+class UndecidedError(ResolutionError): pass
+
+
+# The logic.Session holding the current discourse context, if any.
+_session = None
+
 
+class CandidateCheck(object):
+  def __init__(self, target, base_drs):
+    self.target = target
+    self.base_drs = base_drs
+    self.result = None
+    self.error = None
+    self.finished = threading.Event()
 
-def Resolve(drs, context, is_question):
+
+def Resolve(drs, context, is_question, cancel=None):
   # Questions are not added to the context as facts.
   if is_question:
     drs = drs.Copy()
@@ -24,14 +48,17 @@ def Resolve(drs, context, is_question):
   const_context = context if is_question else None
   
   # Bind presuppositions as possible.
-  ResolveAnaphora(drs, const_context, accommodate=False, pronouns=False)
+  ResolveAnaphora(drs, const_context, accommodate=False, pronouns=False,
+                  cancel=cancel)
   
   # Accommodate presuppositions that could not have been bound. This might
   # create new referents for pronouns.
-  ResolveAnaphora(drs, const_context, accommodate=True, pronouns=False)
+  ResolveAnaphora(drs, const_context, accommodate=True, pronouns=False,
+                  cancel=cancel)
   
   # Bind all pronouns.
-  ResolveAnaphora(drs, const_context, accommodate=False, pronouns=True)
+  ResolveAnaphora(drs, const_context, accommodate=False, pronouns=True,
+                  cancel=cancel)
 
   # Apply all equation conditions.
   drs.Simplify()
@@ -45,16 +72,16 @@ def Resolve(drs, context, is_question):
   return drs
 
 
-def ResolveAnaphora(drs, const_context, accommodate, pronouns):
+def ResolveAnaphora(drs, const_context, accommodate, pronouns, cancel=None):
   for cond in drs.conditions:
     for subdrs in cond.GetChildDRSs():
-      ResolveAnaphora(subdrs, const_context, accommodate, pronouns)
+      ResolveAnaphora(subdrs, const_context, accommodate, pronouns, cancel)
 
     if isinstance(cond, ResolutionCondition):
       if not pronouns and cond.type.startswith('pronoun-'):
         continue
       drs.RemoveCondition(cond)
-      target = ResolveCondition(cond, const_context)
+      target = ResolveCondition(cond, const_context, cancel)
 ##      print 'Resolving', cond
       if target:
         target_ref, target_drs = target
@@ -84,7 +111,12 @@ def ResolveAnaphora(drs, const_context, accommodate, pronouns):
           temp_drs += accommodating_drs
           temp_drs.EliminateResolutions()
           temp_drs.Simplify()
-          if logic.IsConsistent(temp_drs):
+          consistent = logic.IsConsistent(temp_drs, session=_session,
+                                          cancel=cancel)
+          if consistent is None:
+            raise UndecidedError('Could not decide accommodation within '
+                                 'budget.', cond)
+          elif consistent:
 ##            print potential_drs.summary, '+=', temp_drs.summary
             potential_drs += accommodating_drs
             accomodated = True
@@ -95,7 +127,7 @@ def ResolveAnaphora(drs, const_context, accommodate, pronouns):
         drs.AddCondition(cond)
 
 
-def ResolveCondition(cond, context_drs=None):
+def ResolveCondition(cond, context_drs=None, cancel=None):
   ref, requirements = cond.ref, cond.requirements
   assert not isinstance(ref, NamedReferent)
 
@@ -106,33 +138,83 @@ def ResolveCondition(cond, context_drs=None):
     accessible_refs = accessible_refs + extra_refs
   test = IsProvable if cond.type == 'presuppose' else IsConsistent
 
+  # Candidates are checked concurrently but settled in order of preference,
+  # so the first one to pass wins as before. Checks that haven't started when
+  # it is found are skipped, and the prover jobs of those still running are
+  # cancelled.
+  # Candidates that the requirements contradict outright, such as "he" and
+  # a table, are dropped without asking the prover.
+  required = requirements.GetUnaryLiterals().get(ref, NO_LITERALS)
+  checks = []
   for target, base_drs in accessible_refs:
     if not AreRefsCompatible(target, ref):
       continue
-    if test(ref, target, base_drs, requirements):
-      return target, base_drs
+    known = base_drs.GetUnaryLiterals().get(target, NO_LITERALS)
+    if known[0] & required[1] or known[1] & required[0]:
+      continue
+    checks.append(CandidateCheck(target, base_drs))
+  queue = Queue.Queue()
+  for check in checks:
+    queue.put(check)
+  checks_cancel = logic.CancelToken(cancel)
+  for _ in range(min(PARALLEL_CANDIDATES, len(checks))):
+    worker = threading.Thread(target=RunChecks,
+                              args=(queue, checks_cancel, test, ref,
+                                    requirements))
+    worker.daemon = True
+    worker.start()
+
+  # A candidate the prover couldn't decide might have won had it not run out
+  # of budget, so neither a less preferred candidate nor accommodation is
+  # used in its place.
+  try:
+    for check in checks:
+      check.finished.wait()
+      if check.error:
+        exception_type, exception, traceback = check.error
+        raise exception_type, exception, traceback
+      elif check.result:
+        return check.target, check.base_drs
+      elif check.result is None:
+        raise UndecidedError('Could not decide anaphor within budget.', cond)
+  finally:
+    checks_cancel.Cancel()
 
   if cond.type.startswith('pronoun-'):
     raise ResolutionError('Could not resolve anaphor.', cond)
 
 
+def RunChecks(queue, cancel, test, ref, requirements):
+  while not cancel.IsCancelled():
+    try:
+      check = queue.get_nowait()
+    except Queue.Empty:
+      return
+    try:
+      check.result = test(ref, check.target, check.base_drs, requirements,
+                          cancel)
+    except Exception:
+      check.error = sys.exc_info()
+    check.finished.set()
+
+
 def AreRefsCompatible(target, ref):
   return (target != ref and
           (target.type == ref.type or
            ref.type == SINGULAR_TYPE and target.type == PLURAL_TYPE))
 
 
-def IsConsistent(ref, target, base_drs, requirements):
+def IsConsistent(ref, target, base_drs, requirements, cancel=None):
   assert not isinstance(ref, NamedReferent)
 ##  print 'Validating', ref, '=', target
   temp_drs = base_drs + requirements
   temp_drs.EliminateResolutions()
   temp_drs.Simplify()
   temp_drs.ReplaceReferent(ref, target, add_new=True)
-  return logic.IsConsistent(temp_drs)
+  return logic.IsConsistent(temp_drs, session=_session, cancel=cancel)
 
 
-def IsProvable(ref, target, base_drs, requirements):
+def IsProvable(ref, target, base_drs, requirements, cancel=None):
   assert not isinstance(ref, NamedReferent)
 ##  print 'Proving', ref, '=', target
 ##  print '  IF ', base_drs
@@ -152,13 +234,8 @@ def IsProvable(ref, target, base_drs, requirements):
   
 ##  print '  IF_RES ', temp_base
 ##  print '  THEN_RES ', temp_reqs
-  mace_result = logic.IsConsistent(temp_base)
-##  print '  MACE RESULT:', mace_result
-  if not mace_result:
-    return False
-  prover_result = logic.IsProvable(temp_base, temp_reqs)
-##  print '  PROVER RESULT:', prover_result
-  return mace_result and prover_result
+  return logic.IsConsistentAndProvable(temp_base, temp_reqs, session=_session,
+                                       cancel=cancel)
 
 
 def ResolveEqualities(root_drs):
@@ -181,9 +258,9 @@ def ResolveEquality(root_drs, cond):
         drs.RemoveCondition(cond)
 
 
-def ResolveStatement(drs, context):
-  return Resolve(drs, context, False)
+def ResolveStatement(drs, context, cancel=None):
+  return Resolve(drs, context, False, cancel)
 
 
-def ResolveQuestion(drs, context):
-  return Resolve(drs, context, True)
+def ResolveQuestion(drs, context, cancel=None):
+  return Resolve(drs, context, True, cancel)
@@ -1,6 +1,7 @@
 import collections
 import cPickle as pickle
 import os
+import threading
 import nltk.corpus
 import cfg_parser
 import logic
@@ -9,6 +10,10 @@ from drs import *
 
 
 PATTERNS_PATH = 'data/patterns.pickle'
+# Optional precomputed hypernym templates, written by build.hypernyms.
+HYPERNYMS_PATH = 'data/hypernyms.pickle'
+# Optional precomputed VerbNet frames, written by build.verbs.
+FRAMES_PATH = 'data/frames.pickle'
 
 
 _PERSON_SYNSET = 'person.n.01'
@@ -123,7 +128,26 @@ _RESTRICTION_SYNSETS = {
 
 
 _patterns = None
-_strict_mode = False
+# Synset name -> (hypernyms, negative synsets) for each of its hypernym paths.
+_hypernyms = {}
+# (VerbNet class, pattern) -> (subject restriction, object roles).
+_frames = {}
+
+
+class EvaluationState(threading.local):
+  # Per thread, as the engine evaluates several readings at once.
+  strict_mode = False
+  # Semantic values of subtrees by tree identity, shared by all the readings
+  # evaluated in one pass and by the threads evaluating them, which hold
+  # memo_lock to use it. Values depend on strict_mode, so the engine starts
+  # a new memo for each pass.
+  memo = None
+  memo_lock = None
+  # The logic.CancelToken for the prover jobs of strict mode checks.
+  cancel = None
+
+
+_state = EvaluationState()
 
 
 class EvaluatorError(Exception): pass
@@ -134,7 +158,50 @@ def ReloadPatterns(path=PATTERNS_PATH):
   _patterns = pickle.load(open(path))
 
 
+def ReloadHypernyms(path=HYPERNYMS_PATH):
+  global _hypernyms
+  if os.path.exists(path):
+    _hypernyms = pickle.load(open(path, 'rb'))
+  else:
+    _hypernyms = {}
+
+
+def ReloadFrames(path=FRAMES_PATH):
+  global _frames
+  if os.path.exists(path):
+    _frames = pickle.load(open(path, 'rb'))
+  else:
+    _frames = {}
+
+
 def Evaluate(tree):
+  memo = _state.memo
+  if memo is None:
+    return EvaluateNode(tree)
+
+  # The tree is kept alongside its value so that its id can't be reused.
+  with _state.memo_lock:
+    entry = memo.get(id(tree))
+  if entry is None:
+    # Evaluation recurses into subtrees, so the lock isn't held meanwhile. If
+    # another thread got there first, its value is kept.
+    try:
+      value = EvaluateNode(tree)
+    except EvaluatorError, e:
+      value = e
+    with _state.memo_lock:
+      entry = memo.setdefault(id(tree), (tree, value))
+
+  value = entry[1]
+  if isinstance(value, EvaluatorError):
+    raise value
+  elif isinstance(value, DRS):
+    return value.Copy()
+  else:
+    return value
+
+
+def EvaluateNode(tree):
   key = tree.node.get('RUL', tree.node.get(cfg_parser._TYPE_FEATURE))
   return _RULE_HANDLERS[key](tree)
 
@@ -229,12 +296,38 @@ def GetGenderConditions(tree, ref):
 
 def GetHypernymConditions(synset, ref):
   alternatives = []
+  for hypernyms, negatives in GetHypernymTemplate(synset):
+    conds = [PredicateCondition(i, ref, informative=False) for i in hypernyms]
+    for negative_synset in negatives:
+      pred = PredicateCondition(negative_synset, ref, informative=False)
+      cond = NegationCondition(pred, informative=False)
+      conds.append(cond)
+    alternatives.append(conds)
+
+  while len(alternatives) > 1:
+    cond = AlternationCondition(DRS([], alternatives[0]),
+                                DRS([], alternatives[1]),
+                                informative=False)
+    alternatives[:2] = [[cond]]
+
+  return alternatives[0]
+
+
+def GetHypernymTemplate(synset):
+  # Reading the hypernym paths from WordNet is slow, so each synset's are
+  # only worked out once and reused for every referent.
+  template = _hypernyms.get(synset)
+  if template is None:
+    template = _hypernyms[synset] = MakeHypernymTemplate(synset)
+  return template
+
+
+def MakeHypernymTemplate(synset):
+  templates = []
   synset = nltk.corpus.wordnet.synset(synset)
   #for path in [sum(synset.hypernym_paths(), [])]:
   for path in synset.hypernym_paths():
     hypernyms = set(i.name for i in path)
-    conds = [PredicateCondition(i, ref, informative=False) for i in hypernyms]
-
     negatives = []
 
     # TODO: Switch to something more generic.
@@ -276,20 +369,9 @@ def GetHypernymConditions(synset, ref):
         if 'animal.n.01' not in hypernyms:
           negatives += ['animal.n.01']
 
-    for negative_synset in set(negatives):
-      pred = PredicateCondition(negative_synset, ref, informative=False)
-      cond = NegationCondition(pred, informative=False)
-      conds.append(cond)
-
-    alternatives.append(conds)
-
-  while len(alternatives) > 1:
-    cond = AlternationCondition(DRS([], alternatives[0]),
-                                DRS([], alternatives[1]),
-                                informative=False)
-    alternatives[:2] = [[cond]]
+    templates.append((tuple(hypernyms), tuple(set(negatives))))
 
-  return alternatives[0]
+  return tuple(templates)
 
 
 def GetPossessionConditions(owner, owned):
@@ -303,12 +385,19 @@ def GetPossessionConditions(owner, owned):
 def IsFragmentConsistent(drs, context=None):
   try:
     if context:
-      context = drt.resolve.ResolveStatement(context, None)
-    drs = drt.resolve.ResolveStatement(drs, context)
+      context = drt.resolve.ResolveStatement(context, None, _state.cancel)
+    drs = drt.resolve.ResolveStatement(drs, context, _state.cancel)
+  except drt.resolve.UndecidedError:
+    raise
   except drt.resolve.ConsistencyError:
     return False
-  
-  return logic.IsConsistent(drs)
+
+  consistent = logic.IsConsistent(drs, session=drt.resolve._session,
+                                  cancel=_state.cancel)
+  if consistent is None:
+    raise drt.resolve.UndecidedError('Could not decide fragment consistency '
+                                     'within budget.')
+  return consistent
 
 
 def MakeConjunctionApplication(left_lambda, conjunction, right_lambda):
@@ -427,30 +516,54 @@ def MakeApplyThemeRole(verb_ref, role, restrictions):
   return ApplyThemeRole
 
 
+def GetVerbFrame(classname, pattern):
+  frame = _frames.get((classname, pattern))
+  if frame is None:
+    frame_id = min(_patterns[pattern][2][classname])
+    frame = _frames[classname, pattern] = MakeVerbFrame(classname, frame_id)
+  return frame
+
+
+def MakeVerbFrame(classname, frame_id):
+  # Returns the restriction on the subject and, for each node following the
+  # verb, its role and restriction, or None if it is not an NP.
+  vnclass = nltk.corpus.verbnet.vnclass(classname)
+  frame = vnclass.findall('FRAMES/FRAME')[frame_id]
+  restrictions = GetVerbnetRestrictions(vnclass)
+  syntax_nodes = frame.findall('SYNTAX/*')
+
+  subject_role = syntax_nodes[0].attrib['value']
+  subject_restriction = restrictions.get(subject_role)
+
+  object_roles = []
+  for role_node in syntax_nodes[2:]:
+    if role_node.tag == 'NP':
+      assert 'value' in role_node.attrib
+      role = role_node.attrib['value']
+      object_roles.append((role, restrictions.get(role)))
+    else:
+      object_roles.append(None)
+
+  return subject_restriction, tuple(object_roles)
+
+
 def MakeVerbnetVerbEvaluator(classname, verb_synset, pattern):
   def EvaluateVerbnetVerb(object_trees):
     MergeLiterals(object_trees)
     
     # Setup main variables.
-    vnclass = nltk.corpus.verbnet.vnclass(classname)
-    frame_id = min(_patterns[pattern][2][classname])
-    frame = vnclass.findall('FRAMES/FRAME')[frame_id]
+    subject_restriction, object_roles = GetVerbFrame(classname, pattern)
     verb_ref = Referent(VERB_TYPE)
-    restrictions = GetVerbnetRestrictions(vnclass)
-    syntax_nodes = frame.findall('SYNTAX/*')
     
     # Define subject.
-    subject_role = syntax_nodes[0].attrib['value']
     subject_role_functor = MakeApplyThemeRole(
-        verb_ref, 'Agent', restrictions.get(subject_role))
+        verb_ref, 'Agent', subject_restriction)
     
     # Collect objects.
     objects_boxes = []
-    for role_node, parsed_node in zip(syntax_nodes[2:], object_trees):
-      if role_node.tag == 'NP':
-        assert 'value' in role_node.attrib
-        role = role_node.attrib['value']
-        restriction = restrictions.get(role)
+    for object_role, parsed_node in zip(object_roles, object_trees):
+      if object_role:
+        role, restriction = object_role
         role_functor = MakeApplyThemeRole(verb_ref, role, restriction)
         object = Evaluate(parsed_node)
         objects_boxes.append(object(role_functor))
@@ -734,11 +847,12 @@ def EvaluateConditionalSentence(tree):
   # S[TYP=dcl,RUL=2] -> Cond S[TYP=dcl] Pnct[TYP=com] S[TYP=dcl]
   # S[TYP=dcl,RUL=3] -> Cond S[TYP=dcl] Then S[TYP=dcl]
   antecedent = Evaluate(tree[1])
-  if _strict_mode and not IsFragmentConsistent(antecedent):
+  if _state.strict_mode and not IsFragmentConsistent(antecedent):
     raise EvaluatorError('An antecedent failed consistency check.')
 
   consequent = Evaluate(tree[3])
-  if _strict_mode and not IsFragmentConsistent(consequent, antecedent):
+  if (_state.strict_mode and
+      not IsFragmentConsistent(consequent, antecedent)):
     raise EvaluatorError('A consequent failed consistency check.')
 
   return DRS([], [ImplicationCondition(antecedent, consequent)])
@@ -1190,3 +1304,5 @@ _RULE_HANDLERS = {
 }
 
 ReloadPatterns()
+ReloadHypernyms()
+ReloadFrames()
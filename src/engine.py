@@ -1,3 +1,10 @@
+import collections
+import copy
+import itertools
+import multiprocessing
+import Queue
+import sys
+import threading
 import nltk
 import cfg_parser
 import drt.drs
@@ -8,71 +15,202 @@ import tokenizer
 import utterance
 
 
+# Number of parse trees interpreted concurrently. 1 interprets them one by
+# one.
+PARALLEL_TREES = multiprocessing.cpu_count()
+# Number of distinct inputs whose parses and semantic values are kept.
+RESULT_CACHE_SIZE = 100
 CONDITION_TRIGGERS = set(['if', 'when', 'whenever', 'given', 'as', 'assuming',
                           'provided', 'proposing', 'since', 'supposing'])
 
 
+class ParseResult(object):
+  # The parse forest of an input and, by strict mode, the semantic value of
+  # each of its trees interpreted so far. Neither depends on the context, so
+  # a repeated input only has to be resolved again.
+  def __init__(self, forest):
+    self.forest = forest
+    self.values = {True: {}, False: {}}
+
+
+_results = collections.OrderedDict()
+_results_lock = threading.Lock()
+
+
+def GetParseResult(tokens):
+  key = tuple(tokens)
+  with _results_lock:
+    result = _results.pop(key, None)
+    if result is not None:
+      _results[key] = result
+      return result
+
+  result = ParseResult(cfg_parser.ParseForest(tokens))
+  with _results_lock:
+    _results[key] = result
+    while len(_results) > RESULT_CACHE_SIZE:
+      _results.popitem(last=False)
+  return result
+
+
+def RenewReferents(drs):
+  # Each utterance introduces its own referents, so a cached semantic value
+  # is copied with fresh ones in place of those it was built with.
+  memo = {}
+  for box in drs.Walk():
+    refs = list(box.referents)
+    for cond in box.conditions:
+      refs.extend(cond.GetReferents())
+    for ref in refs:
+      if not isinstance(ref, drt.drs.NamedReferent) and id(ref) not in memo:
+        memo[id(ref)] = drt.drs.Referent(ref.type)
+  return copy.deepcopy(drs, memo)
+
+
 def GetInformativeCopy(drs):
   copy = drs.Copy()
   for d in copy.Walk():
-    d._conditions = [i for i in d._conditions if i.informative]
+    for cond in d.conditions:
+      if not cond.informative:
+        d.RemoveCondition(cond)
   return copy
 
 
-def AnswerQuestion(question_drs, context_drs):
+def AnswerQuestion(question_drs, context_drs, session=None):
   result = None
   if isinstance(question_drs, drt.drs.BooleanQuestionDRS):
     informative_question_drs = GetInformativeCopy(question_drs)
-    positive = logic.IsProvable(context_drs, informative_question_drs)
     inverse_drs = drt.drs.DRS([], [drt.drs.NegationCondition(question_drs)])
-    negative = logic.IsProvable(context_drs, inverse_drs)
-    if positive and negative:
-      raise Exception('This is madness!')
-    elif positive:
-      result = True
-    elif negative:
-      result = False
+    result = logic.ProveEither(context_drs, informative_question_drs,
+                               inverse_drs, session=session)
   else:
-    answers = []
-    target = question_drs.target
-    for possible in context_drs.referents:
-      cond = drt.drs.EqualityCondition(target, possible)
-      question_drs.AddCondition(cond)
-      informative_question_drs = GetInformativeCopy(question_drs)
-      if logic.IsProvable(context_drs, informative_question_drs):
-        answers.append(possible)
-      question_drs.RemoveCondition(cond)
-    result = answers
+    informative_question_drs = GetInformativeCopy(question_drs)
+    result = logic.FindAnswers(context_drs, informative_question_drs,
+                               question_drs.target, context_drs.referents,
+                               session=session)
 
   return result
 
 
-def GetDRSFromTrees(trees, tokens, old_drs):
+class Interpretation(object):
+  def __init__(self, tree):
+    self.tree = tree
+    self.drs = None
+    self.consistent = False
+    self.error = None
+    self.finished = threading.Event()
+
+
+def GetDRSFromTrees(trees, tokens, old_drs, undecided=None, session=None,
+                    values=None):
+  # Up to PARALLEL_TREES trees are interpreted at once, mostly waiting on the
+  # prover, but results are still yielded in tree order. Work that hasn't
+  # started by the time the caller stops reading is skipped, and the prover
+  # jobs of work still running are cancelled.
+  if values is None:
+    values = {True: {}, False: {}}
   strict_mode_values = [True]
   if CONDITION_TRIGGERS.intersection(tokens):
     strict_mode_values.append(False)
 
   for strict_mode in strict_mode_values:
-    drt.rules._strict_mode = strict_mode
-    
-    for tree in trees:
-      try:
-        drs = drt.rules.Evaluate(tree)
-      except drt.rules.EvaluatorError:
-        continue
-      
-      is_question = isinstance(drs, drt.drs.QuestionDRS)
+    tasks = Queue.Queue()
+    cancel = logic.CancelToken()
+    memo = {}
+    memo_lock = threading.Lock()
+    for _ in range(PARALLEL_TREES):
+      worker = threading.Thread(target=InterpretTrees,
+                                args=(tasks, cancel, strict_mode, memo,
+                                      memo_lock, values[strict_mode], old_drs,
+                                      session))
+      worker.daemon = True
+      worker.start()
+
+    remaining = iter(trees)
+    pending = collections.deque()
+    try:
+      for tree in itertools.islice(remaining, PARALLEL_TREES):
+        pending.append(Interpretation(tree))
+        tasks.put(pending[-1])
+      while pending:
+        interpretation = pending.popleft()
+        for tree in itertools.islice(remaining, 1):
+          pending.append(Interpretation(tree))
+          tasks.put(pending[-1])
+
+        interpretation.finished.wait()
+        if interpretation.error:
+          exception_type, exception, traceback = interpretation.error
+          raise exception_type, exception, traceback
+        elif interpretation.consistent:
+          yield interpretation.tree, interpretation.drs
+        elif interpretation.consistent is None and undecided is not None:
+          undecided.append(interpretation.tree)
+    finally:
+      cancel.Cancel()
+      for _ in range(PARALLEL_TREES):
+        tasks.put(None)
+
+
+def InterpretTrees(tasks, cancel, strict_mode, memo, memo_lock, values,
+                   old_drs, session):
+  drt.rules._state.strict_mode = strict_mode
+  drt.rules._state.memo = memo
+  drt.rules._state.memo_lock = memo_lock
+  drt.rules._state.cancel = cancel
+  while True:
+    interpretation = tasks.get()
+    if interpretation is None:
+      return
+    if not cancel.IsCancelled():
       try:
-        drs = drt.resolve.Resolve(drs, old_drs, is_question)
-      except drt.resolve.ConsistencyError:
-        continue
+        InterpretTree(interpretation, values, old_drs, session, cancel)
+      except Exception:
+        interpretation.error = sys.exc_info()
+    interpretation.finished.set()
+
+
+def InterpretTree(interpretation, values, old_drs, session, cancel=None):
+  # Values are kept alongside their trees so that the ids can't be reused,
+  # with None for trees that can't be evaluated.
+  tree = interpretation.tree
+  if id(tree) in values:
+    drs = values[id(tree)][1]
+    if drs is None:
+      return
+    drs = RenewReferents(drs)
+  else:
+    try:
+      drs = drt.rules.Evaluate(tree)
+    except drt.rules.EvaluatorError:
+      values[id(tree)] = (tree, None)
+      return
+    except drt.resolve.UndecidedError:
+      # Strict mode checks fragments as they are evaluated. An undecided
+      # check isn't remembered, as it may be decided another time.
+      interpretation.consistent = None
+      return
+    values[id(tree)] = (tree, drs)
 
-      if logic.IsConsistent(drs):
-        yield tree, drs
+  is_question = isinstance(drs, drt.drs.QuestionDRS)
+  try:
+    drs = drt.resolve.Resolve(drs, old_drs, is_question, cancel)
+  except drt.resolve.UndecidedError:
+    interpretation.consistent = None
+    return
+  except drt.resolve.ConsistencyError:
+    return
 
+  interpretation.drs = drs
+  interpretation.consistent = logic.IsConsistent(drs, session=session,
+                                                 cancel=cancel)
 
-def ProcessString(input, context_drs, queue):
+
+def ProcessString(input, context_drs, queue, session=None):
   queue.put(('post', input, 'input'))
+  if session is None:
+    session = logic.Session(context_drs)
+  drt.resolve._session = session
 
   # Get trees.
   try:
@@ -81,33 +219,34 @@ def ProcessString(input, context_drs, queue):
     queue.put(('post', 'Could not tokenize the input.', 'problem'))
     return
 
+  # Trees come out of the forest best first.
   try:
-    trees = cfg_parser.Parse(tokens)
+    parse_result = GetParseResult(tokens)
+    trees = parse_result.forest
+    trees_count = trees.Count()
   except:
-    trees = []
+    trees_count = 0
 
-  trees_count = len(trees)
   if trees_count == 0:
     message = 'Could not find any parse trees for the input.'
     queue.put(('post', message, 'problem'))
     return
-  if trees_count == cfg_parser.MAX_TREES:
-    trees_count = '%d+' % trees_count
+  if trees_count > cfg_parser.MAX_TREES:
+    trees_count = '%d+' % cfg_parser.MAX_TREES
   queue.put(('post', 'Found %s parse trees.' % trees_count, 'comment'))
 
-  # Order trees.
-  trees.sort(key=cfg_parser.GradeTree, reverse=True)
-
   # Evaluate trees and find the best valid tree.
   if not context_drs:
     context_drs = drt.drs.DRS()
   best_tree = None
   state = None
   interpretations = 0
-  for tree, drs in GetDRSFromTrees(trees, tokens, context_drs):
+  undecided = []
+  for tree, drs in GetDRSFromTrees(trees, tokens, context_drs, undecided,
+                                   session, parse_result.values):
     interpretations += 1
     if isinstance(drs, drt.drs.QuestionDRS):
-      result = AnswerQuestion(drs, context_drs)
+      result = AnswerQuestion(drs, context_drs, session)
       
       if result not in (None, []):
         best_tree = tree
@@ -130,7 +269,7 @@ def ProcessString(input, context_drs, queue):
   queue.put(('post', message, 'comment'))
 
   if not best_tree:
-    best_tree = trees[0]
+    best_tree = trees.GetTree(0)
   #queue.put(('post', str(best_tree), 'comment'))
   queue.put(('post', GetTerminalDefinitions(best_tree), 'comment'))
   
@@ -139,7 +278,12 @@ def ProcessString(input, context_drs, queue):
     queue.put(('post', result, 'result'))
   elif state == 'statement':
     queue.put(('post', 'Statement understood and added to context.', 'result'))
+    session.Update(result)
     queue.put(('update_context', result, None))
+  elif undecided:
+    message = ('Could not verify the consistency of the input within the '
+               'prover time limit.')
+    queue.put(('post', message, 'problem'))
   else:
     message = 'Could not find any consistent interpretation of the input.'
     queue.put(('post', message, 'problem'))
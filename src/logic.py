@@ -1,5 +1,17 @@
+import atexit
+import collections
+import contextlib
+import hashlib
+import multiprocessing
+import Queue
+import re
+import shelve
 import subprocess
 import platform
+import sys
+import threading
+import drt.drs
+import drt.model
 
 
 if platform.system() == 'Windows':
@@ -8,6 +20,17 @@ if platform.system() == 'Windows':
 else:
   MACE_PATH = r'prover/mace4'
   PROVER_PATH = r'prover/prover9'
+POOL_SIZE = multiprocessing.cpu_count()
+CACHE_SIZE = 10000
+# Optional shelve file backing the result cache across restarts.
+CACHE_PATH = None
+# Default per-query budgets. The prover enforces them itself; on top of that
+# the process is killed TIMEOUT_GRACE seconds past its deadline and its
+# address space capped MEMORY_SLACK megabytes above its memory budget.
+MAX_SECONDS = 10
+MAX_MEGS = 200
+TIMEOUT_GRACE = 2
+MEMORY_SLACK = 64
 MACE_FAILURE_MARKER = 'Exiting with failure.'
 MACE_SUCCESS_MARKER = 'Exiting with 1 model.'
 PROVER_FAILURE_MARKER = 'SEARCH FAILED'
@@ -18,6 +41,8 @@ formulas(assumptions).
 end_of_list.
 
 assign(domain_size, %d).
+assign(max_seconds, %d).
+assign(max_megs, %d).
 clear(print_models).
 """
 PROVER_TEMPLATE = """
@@ -30,35 +55,700 @@ formulas(goals).
 end_of_list.
 
 assign(max_proofs, 1).
+assign(max_seconds, %d).
+assign(max_megs, %d).
 clear(auto_denials).
 """
+ANSWER_TEMPLATE = """
+formulas(assumptions).
+  %s.
+end_of_list.
+
+formulas(goals).
+  %s # answer(%s).
+end_of_list.
+
+assign(max_proofs, %d).
+assign(max_seconds, %d).
+assign(max_megs, %d).
+clear(auto_denials).
+"""
+
+
+# Referents are arguments, never followed by a parenthesis as the predicate
+# symbols they can look like are.
+REFERENT_REGEX = re.compile(r'\b([a-z])\d+\b(?!\()')
+QUANTIFIER_REGEX = re.compile(r'^((?:(?:exists|all) \w+ )*)(.*)$')
+ANSWER_REGEX = re.compile(r'\$F # answer\((\w+)\)\.')
+EQUALITY_REGEX = re.compile(r'^(\(?)([a-z]\d+) (!?=) ([a-z]\d+)(\)?)$')
+# Printed by both Mace4 and Prover9 when they give up on a search. Mace4 also
+# prints its failure marker in this case, so this must be checked first.
+BUDGET_REGEX = re.compile(r'exit \(max_(?:sec|megs)\w*\)')
+
+
+# A query settles to True or False, or to None (unknown) if it ran out of
+# time or memory first. Unknown results are never cached, except by
+# RunAnswers for searches that ran out of budget. Queries settled
+# in-process by the model search are passed around as plain bools.
+Query = collections.namedtuple('Query', ['command', 'input', 'success_marker',
+                                         'failure_marker', 'max_seconds',
+                                         'max_megs'])
+
+
+_pool = None
+_pool_lock = threading.Lock()
 
 
 class ProverError(Exception): pass
 
 
-def IsConsistent(drs):
-  model = MACE_TEMPLATE % (drs.Formulate(), max(len(drs.referents), 2))
-  return Run(MACE_PATH, model, MACE_SUCCESS_MARKER, MACE_FAILURE_MARKER)
+class ResultCache(object):
+  def __init__(self, size=CACHE_SIZE, path=CACHE_PATH):
+    self.size = size
+    self.entries = collections.OrderedDict()
+    self.store = shelve.open(path, protocol=2) if path else None
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def Get(self, key):
+    with self.lock:
+      value = self.entries.pop(key, None)
+      if value is None and self.store is not None:
+        value = self.store.get(key)
+      if value is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self.entries[key] = value
+        self.Trim()
+      return value
+
+  def Put(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = value
+      self.Trim()
+      if self.store is not None:
+        self.store[key] = value
+
+  def Trim(self):
+    while len(self.entries) > self.size:
+      self.entries.popitem(last=False)
+
+  def Close(self):
+    with self.lock:
+      if self.store is not None:
+        self.store.close()
+        self.store = None
+
+
+class CancelToken(object):
+  # Lets a caller give up on the queries it submitted once it has its answer,
+  # killing the processes still running them. Tokens made from a parent are
+  # cancelled along with it.
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.items = set()
+    self.cancelled = False
+    self.lock = threading.Lock()
+    if parent is not None:
+      parent.Add(self)
+
+  def Add(self, item):
+    with self.lock:
+      if not self.cancelled:
+        self.items.add(item)
+        return
+    item.Cancel()
+
+  def Discard(self, item):
+    with self.lock:
+      self.items.discard(item)
+
+  def Cancel(self):
+    with self.lock:
+      self.cancelled = True
+      items, self.items = self.items, set()
+    for item in items:
+      item.Cancel()
+    if self.parent is not None:
+      self.parent.Discard(self)
+
+  def IsCancelled(self):
+    return self.cancelled
+
+
+class ProverJob(object):
+  def __init__(self, query, notify=None, cancel=None):
+    self.query = query
+    self.notify = notify
+    self.cancel = cancel
+    self.process = None
+    self.cancelled = False
+    self.expired = False
+    self.output = None
+    self.error = None
+    self.lock = threading.Lock()
+    self.finished = threading.Event()
+
+  def Start(self, process):
+    with self.lock:
+      if self.cancelled:
+        return False
+      self.process = process
+      return True
+
+  def Finish(self):
+    if self.cancel is not None:
+      self.cancel.Discard(self)
+    self.finished.set()
+    if self.notify:
+      self.notify.put(self)
+
+  def Cancel(self):
+    with self.lock:
+      self.cancelled = True
+      if self.process and self.process.poll() is None:
+        self.process.kill()
+
+  def Expire(self):
+    with self.lock:
+      if self.process and self.process.poll() is None:
+        self.expired = True
+        self.process.kill()
+
+  def Wait(self):
+    self.finished.wait()
+    if self.error:
+      exception_type, exception, traceback = self.error
+      raise exception_type, exception, traceback
+    return self.output
+
+
+class ProverWorker(threading.Thread):
+  # Each worker keeps an idle mace/prover process per command waiting on its
+  # stdin, so the exec and startup of the binary happen before the query
+  # arrives rather than on the critical path.
+  def __init__(self, jobs):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.jobs = jobs
+    self.standby = {}
+
+  def run(self):
+    while True:
+      self.Execute(self.jobs.get())
+
+  def Execute(self, job):
+    try:
+      if not job.cancelled:
+        # Standby processes are keyed by their memory cap as well, since the
+        # limit has to be set before the binary starts.
+        key = job.query.command, job.query.max_megs
+        process = self.standby.pop(key, None) or Spawn(*key)
+        if not job.Start(process):
+          # Cancelled before the process got any input, so it stays warm.
+          self.standby[key] = process
+        else:
+          # The replacement is started alongside the search, off its path.
+          refill = threading.Thread(target=self.Refill, args=(key,))
+          refill.daemon = True
+          refill.start()
+          try:
+            timer = threading.Timer(job.query.max_seconds + TIMEOUT_GRACE,
+                                    job.Expire)
+            timer.start()
+            try:
+              output = process.communicate(job.query.input)[0]
+            finally:
+              timer.cancel()
+            # A process killed by the timer or by a signal from hitting its
+            # memory cap has no verdict.
+            if not job.expired and process.returncode >= 0:
+              job.output = output
+          finally:
+            refill.join()
+    except Exception:
+      job.error = sys.exc_info()
+    job.Finish()
+
+  def Refill(self, key):
+    try:
+      self.standby[key] = Spawn(*key)
+    except OSError:
+      # The next query spawns its own process and reports the error.
+      pass
+
+  def Shutdown(self):
+    for process in self.standby.values():
+      if process.poll() is None:
+        process.kill()
+    self.standby.clear()
+
+
+class ProverPool(object):
+  def __init__(self, size=POOL_SIZE):
+    self.jobs = Queue.Queue()
+    self.workers = [ProverWorker(self.jobs) for _ in range(max(size, 1))]
+    for worker in self.workers:
+      worker.start()
+
+  def Submit(self, query, notify=None, cancel=None):
+    job = ProverJob(query, notify, cancel)
+    if cancel is not None:
+      cancel.Add(job)
+    self.jobs.put(job)
+    return job
+
+  def Shutdown(self):
+    for worker in self.workers:
+      worker.Shutdown()
+
+
+def GetPool():
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ProverPool(POOL_SIZE)
+      atexit.register(_pool.Shutdown)
+  return _pool
+
+
+def ConfigureCache(size=CACHE_SIZE, path=CACHE_PATH):
+  global _cache
+  _cache.Close()
+  _cache = ResultCache(size, path)
+
+
+def GetCacheStats():
+  return {'hits': _cache.hits,
+          'misses': _cache.misses,
+          'size': len(_cache.entries)}
+
+
+def GetCacheKey(command, input):
+  return hashlib.sha1('%s\0%s' % (command, input)).hexdigest()
+
 
+def Spawn(command, max_megs=None):
+  # The address space cap is set by a shell that then execs the binary, as
+  # running Python code in the child (preexec_fn) isn't safe while other
+  # threads are about.
+  args = [command]
+  if platform.system() != 'Windows' and max_megs:
+    args = ['/bin/sh', '-c', 'ulimit -v %d; exec "$0"' %
+            ((max_megs + MEMORY_SLACK) * 1024), command]
+  return subprocess.Popen(args,
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
 
-def IsProvable(assumption_drs, theorem_drs):
-  assumptions = assumption_drs.FormulateConditions()
-  theorem = theorem_drs.Formulate(enforce_unique=False)
-  theorem = PROVER_TEMPLATE % (assumptions, theorem)
-  return Run(PROVER_PATH, theorem, PROVER_SUCCESS_MARKER, PROVER_FAILURE_MARKER)
 
+def GetBudget(max_seconds=None, max_megs=None):
+  if max_seconds is None:
+    max_seconds = MAX_SECONDS
+  if max_megs is None:
+    max_megs = MAX_MEGS
+  return max_seconds, max_megs
 
-def Run(command, input, success_marker, failure_marker):
-  p = subprocess.Popen(command,
-                       shell=True,
-                       stdin=subprocess.PIPE,
-                       stdout=subprocess.PIPE,
-                       stderr=subprocess.PIPE)
-  result = p.communicate(input)[0]
-  if success_marker in result:
+
+class Session(object):
+  # Holds the discourse context formulated between sentences. LADR binaries
+  # can't keep assumptions loaded across runs, so each query still sends the
+  # whole context, but the context is formulated once per statement when it
+  # is accepted instead of once per query. Only conditions and referents the
+  # session hasn't seen are formulated at query time.
+  def __init__(self, drs=None):
+    self.formulas = {}
+    self.referents = []
+    self.inequalities = []
+    self.lock = threading.Lock()
+    if drs:
+      self.Update(drs)
+
+  def Update(self, drs):
+    formulas = {}
+    for cond in drs.conditions:
+      formula = self.formulas.get(cond)
+      if formula is None:
+        try:
+          formula = cond.Formulate()
+        except drt.drs.FormulationError:
+          continue
+      # Conditions are mutable, so keep a private copy as the key.
+      formulas[cond.Copy()] = formula
+    # Simplifying the context can drop referents, so the uniqueness
+    # constraints are rebuilt rather than extended.
+    referents = sorted(drs.referents, key=lambda i: i.id)
+    inequalities = ['%s != %s' % (i, referent)
+                    for index, referent in enumerate(referents)
+                    for i in referents[:index]]
+    with self.lock:
+      self.formulas = formulas
+      self.referents = referents
+      self.inequalities = inequalities
+
+  def FormulateConditions(self, drs, enforce_unique=True):
+    with self.lock:
+      formulas = self.formulas
+      referents = list(self.referents)
+      inequalities = list(self.inequalities)
+    conds = [formulas.get(i) or i.Formulate() for i in drs.conditions]
+    uniqueness = []
+    if enforce_unique:
+      if drs.referents.issuperset(referents):
+        uniqueness = inequalities
+        for referent in sorted(drs.referents.difference(referents),
+                               key=lambda i: i.id):
+          uniqueness.extend('%s != %s' % (i, referent) for i in referents)
+          referents.append(referent)
+      else:
+        referents = list(drs.referents)
+        for i, r in enumerate(referents):
+          for s in referents[i+1:]:
+            uniqueness.append('%s != %s' % (r, s))
+    joined = '(%s)' % ' & '.join(conds + uniqueness)
+    if joined == '()':
+      joined = '1=1'
+    return joined
+
+  def Formulate(self, drs):
+    return '%s (%s)' % (drs.FormulateDomain(), self.FormulateConditions(drs))
+
+
+def Canonicalize(formula, renaming=None):
+  # Referent ids come from an ever-increasing global counter, so identical
+  # DRSs formulate differently. Sort the top-level conjuncts by their shape
+  # and renumber referents in order of first occurrence. Formulas sharing
+  # referents must be canonicalized with the same renaming dict.
+  if renaming is None:
+    renaming = {}
+  prefix, formula = QUANTIFIER_REGEX.match(formula.strip()).groups()
+  while IsWrapped(formula):
+    formula = formula[1:-1]
+  conjuncts = SplitConjuncts(formula)
+  # (In)equalities between referents say nothing about which is which, so
+  # they are renamed last.
+  conjuncts.sort(key=lambda i: (bool(EQUALITY_REGEX.match(i)),
+                                REFERENT_REGEX.sub(r'\1', i)))
+
+  def Rename(match):
+    referent = match.group(0)
+    if referent not in renaming:
+      renaming[referent] = '%s%d' % (match.group(1), len(renaming) + 1)
+    return renaming[referent]
+
+  # Renaming can leave symmetric conjuncts with their operands in either
+  # order, so fix the order and sort again by the renamed text.
+  conjuncts = sorted(OrderOperands(REFERENT_REGEX.sub(Rename, i))
+                     for i in conjuncts)
+  body = ' & '.join(conjuncts)
+  quantifiers = prefix.split()
+  quantifiers = sorted(zip(quantifiers[::2],
+                           [REFERENT_REGEX.sub(Rename, i)
+                            for i in quantifiers[1::2]]),
+                       key=lambda i: (len(i[1]), i[1]))
+  prefix = ''.join('%s %s ' % i for i in quantifiers)
+  return '%s(%s)' % (prefix, body)
+
+
+def OrderOperands(conjunct):
+  match = EQUALITY_REGEX.match(conjunct)
+  if not match:
+    return conjunct
+  left, ref1, operator, ref2, right = match.groups()
+  ref1, ref2 = sorted([ref1, ref2], key=lambda i: (len(i), i))
+  return '%s%s %s %s%s' % (left, ref1, operator, ref2, right)
+
+
+def IsWrapped(formula):
+  if not formula.startswith('('):
+    return False
+  depth = 0
+  for index, char in enumerate(formula):
+    if char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+      if depth == 0:
+        return index == len(formula) - 1
+  return False
+
+
+def SplitConjuncts(formula):
+  conjuncts = []
+  depth = 0
+  start = 0
+  for index, char in enumerate(formula):
+    if char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+    elif char == '&' and depth == 0:
+      conjuncts.append(formula[start:index].strip())
+      start = index + 1
+  conjuncts.append(formula[start:].strip())
+  return conjuncts
+
+
+def GetDomainSize(drs):
+  return max(len(drs.referents), 2)
+
+
+def GetConsistencyQuery(drs, max_seconds=None, max_megs=None, session=None):
+  # Most models are small enough to search for in-process. Mace4 only gets
+  # the ones that search gives up on.
+  max_seconds, max_megs = GetBudget(max_seconds, max_megs)
+  formula = Canonicalize((session or Session()).Formulate(drs))
+  model = MACE_TEMPLATE % (formula, GetDomainSize(drs), max_seconds, max_megs)
+  return SearchModel(Query(MACE_PATH, model, MACE_SUCCESS_MARKER,
+                           MACE_FAILURE_MARKER, max_seconds, max_megs),
+                     drs, GetDomainSize(drs))
+
+
+def GetProofQueries(assumption_drs, theorem_drs, max_seconds=None,
+                    max_megs=None, session=None):
+  # Returns a Prover9 query for the theorem and a Mace4 query looking for a
+  # countermodel. Either one can settle the question on its own.
+  max_seconds, max_megs = GetBudget(max_seconds, max_megs)
+  renaming = {}
+  assumptions = Canonicalize(
+      (session or Session()).FormulateConditions(assumption_drs), renaming)
+  theorem = Canonicalize(theorem_drs.Formulate(enforce_unique=False),
+                         renaming)
+  proof = PROVER_TEMPLATE % (assumptions, theorem, max_seconds, max_megs)
+  domain_size = GetDomainSize(assumption_drs)
+  counterexample = MACE_TEMPLATE % ('%s & -(%s)' % (assumptions, theorem),
+                                    domain_size, max_seconds, max_megs)
+  countermodel = SearchModel(Query(MACE_PATH, counterexample,
+                                   MACE_SUCCESS_MARKER, MACE_FAILURE_MARKER,
+                                   max_seconds, max_megs),
+                             assumption_drs, domain_size, theorem_drs)
+  return (Query(PROVER_PATH, proof, PROVER_SUCCESS_MARKER,
+                PROVER_FAILURE_MARKER, max_seconds, max_megs),
+          countermodel)
+
+
+def SearchModel(query, *args):
+  # Settles a Mace4 query with the in-process model search if it can, under
+  # the same cache entry the binary's result would have.
+  key = GetCacheKey(query.command, query.input)
+  result = _cache.Get(key)
+  if result is None:
+    result = drt.model.IsSatisfiable(*args)
+    if result is None:
+      return query
+    _cache.Put(key, result)
+  return result
+
+
+def IsConsistent(drs, max_seconds=None, max_megs=None, session=None,
+                 cancel=None):
+  return Run(GetConsistencyQuery(drs, max_seconds, max_megs, session), cancel)
+
+
+def IsProvable(assumption_drs, theorem_drs, max_seconds=None, max_megs=None,
+               session=None, cancel=None):
+  queries = GetProofQueries(assumption_drs, theorem_drs, max_seconds, max_megs,
+                            session)
+  with contextlib.closing(Race(queries, cancel)) as race:
+    for index, result in race:
+      if index == 0 and result is not None:
+        return result
+      elif index == 1 and result:
+        return False
+  return None
+
+
+def IsConsistentAndProvable(base_drs, theorem_drs, max_seconds=None,
+                            max_megs=None, session=None, cancel=None):
+  # Returns None if neither a refutation nor both confirmations came in
+  # within the budget.
+  queries = ((GetConsistencyQuery(base_drs, max_seconds, max_megs, session),) +
+             GetProofQueries(base_drs, theorem_drs, max_seconds, max_megs,
+                             session))
+  confirmed = set()
+  with contextlib.closing(Race(queries, cancel)) as race:
+    for index, result in race:
+      if index == 2 and result is not None:
+        result = not result
+      if result is False:
+        return False
+      elif result:
+        confirmed.add(index)
+      if confirmed.issuperset((0, 1)):
+        return True
+  return None
+
+
+def ProveEither(assumption_drs, positive_drs, negative_drs, max_seconds=None,
+                max_megs=None, session=None, cancel=None):
+  # Returns True if the positive theorem is provable, False if the negative
+  # one is, or None if neither is or the search gave up.
+  queries = (GetProofQueries(assumption_drs, positive_drs, max_seconds,
+                             max_megs, session) +
+             GetProofQueries(assumption_drs, negative_drs, max_seconds,
+                             max_megs, session))
+  refuted = set()
+  with contextlib.closing(Race(queries, cancel)) as race:
+    for index, result in race:
+      proof, countermodel = index in (0, 2), index in (1, 3)
+      if proof and result:
+        return index == 0
+      elif (proof and not result) or (countermodel and result):
+        refuted.add(index // 2)
+        if len(refuted) == 2:
+          return None
+  return None
+
+
+def FindAnswers(assumption_drs, question_drs, target, candidates,
+                max_seconds=None, max_megs=None, session=None, cancel=None):
+  # Finds all candidates provably equal to the target in one prover search
+  # using an answer literal. Each proof reports the value it bound the target
+  # to; proven answers are excluded and the search repeated until no new ones
+  # come up, which takes one round per batch of answers rather than one proof
+  # per candidate. If a round runs out of budget, the answers found so far
+  # are returned.
+  max_seconds, max_megs = GetBudget(max_seconds, max_megs)
+  candidates = list(candidates)
+  if target not in question_drs.referents:
+    return FindAnswersSeparately(assumption_drs, question_drs, target,
+                                 candidates, max_seconds, max_megs, session,
+                                 cancel)
+
+  question_drs = question_drs.Copy()
+  by_id = dict((i.id, i) for i in candidates)
+  formula = (session or Session()).FormulateConditions(assumption_drs)
+  answers = set()
+  while len(answers) < len(candidates):
+    renaming = {}
+    assumptions = Canonicalize(formula, renaming)
+    goal = Canonicalize(question_drs.Formulate(enforce_unique=False),
+                        renaming)
+    max_proofs = len(candidates) - len(answers)
+    input = ANSWER_TEMPLATE % (assumptions, goal, renaming[target.id],
+                               max_proofs, max_seconds, max_megs)
+    proved, names = RunAnswers(Query(PROVER_PATH, input, PROVER_SUCCESS_MARKER,
+                                     PROVER_FAILURE_MARKER, max_seconds,
+                                     max_megs), cancel)
+    if not proved and not names:
+      break
+
+    originals = dict((j, i) for i, j in renaming.iteritems())
+    found = [by_id.get(originals.get(i, i)) for i in names]
+    found = set(i for i in found if i is not None) - answers
+    if not found:
+      if proved is None:
+        break
+      # Only disjunctive or non-candidate answers were produced. Check the
+      # remaining candidates one by one.
+      remaining = [i for i in candidates if i not in answers]
+      answers.update(FindAnswersSeparately(assumption_drs, question_drs,
+                                           target, remaining, max_seconds,
+                                           max_megs, session, cancel))
+      break
+
+    answers.update(found)
+    if proved is None:
+      break
+    for answer in found:
+      inequality = drt.drs.EqualityCondition(target, answer)
+      question_drs.AddCondition(drt.drs.NegationCondition(inequality))
+
+  return [i for i in candidates if i in answers]
+
+
+def FindAnswersSeparately(assumption_drs, question_drs, target, candidates,
+                          max_seconds=None, max_megs=None, session=None,
+                          cancel=None):
+  answers = []
+  for candidate in candidates:
+    candidate_drs = question_drs.Copy()
+    candidate_drs.AddCondition(drt.drs.EqualityCondition(target, candidate))
+    if IsProvable(assumption_drs, candidate_drs, max_seconds, max_megs,
+                  session, cancel):
+      answers.append(candidate)
+  return answers
+
+
+def RunAnswers(query, cancel=None):
+  # Returns a (proved, answer names) pair, with proved None if the search
+  # gave up. A search asked for more proofs than there are answers keeps
+  # going until it runs out of budget, so answers are read from any output
+  # that reports a proof. Such a round is cached with what it found: the
+  # input includes the budget, so a repeat would only run out of it again.
+  # Only a process killed before it finished leaves nothing to cache.
+  key = GetCacheKey(query.command, query.input)
+  result = _cache.Get(key)
+  if result is None:
+    output = GetPool().Submit(query, cancel=cancel).Wait()
+    proved = Interpret(output, query.success_marker, query.failure_marker)
+    names = ()
+    if output is not None and query.success_marker in output:
+      names = tuple(sorted(set(ANSWER_REGEX.findall(output))))
+    result = (proved, names)
+    if output is not None:
+      _cache.Put(key, result)
+  return result
+
+
+def Race(queries, cancel=None):
+  # Runs queries together and yields (index, result) pairs as they finish.
+  # Closing the generator kills whatever is still running.
+  pending = []
+  for index, query in enumerate(queries):
+    if isinstance(query, bool):
+      yield index, query
+      continue
+    result = _cache.Get(GetCacheKey(query.command, query.input))
+    if result is None:
+      pending.append(index)
+    else:
+      yield index, result
+
+  notify = Queue.Queue()
+  jobs = {}
+  try:
+    for index in pending:
+      jobs[GetPool().Submit(queries[index], notify, cancel)] = index
+    for _ in range(len(jobs)):
+      job = notify.get()
+      query = queries[jobs[job]]
+      result = Interpret(job.Wait(), query.success_marker,
+                         query.failure_marker)
+      if result is not None:
+        _cache.Put(GetCacheKey(query.command, query.input), result)
+      yield jobs[job], result
+  finally:
+    for job in jobs:
+      job.Cancel()
+
+
+def Run(query, cancel=None):
+  if isinstance(query, bool):
+    return query
+  key = GetCacheKey(query.command, query.input)
+  result = _cache.Get(key)
+  if result is None:
+    output = GetPool().Submit(query, cancel=cancel).Wait()
+    result = Interpret(output, query.success_marker, query.failure_marker)
+    if result is not None:
+      _cache.Put(key, result)
+  return result
+
+
+def Interpret(output, success_marker, failure_marker):
+  if output is None or BUDGET_REGEX.search(output):
+    return None
+  elif success_marker in output:
     return True
-  elif failure_marker in result:
+  elif failure_marker in output:
     return False
   else:
-    raise ProverError('Could not understand mace/prover output:\n%s' % result)
+    raise ProverError('Could not understand mace/prover output:\n%s' % output)
+
+
+_cache = ResultCache()
+atexit.register(lambda: _cache.Close())
@@ -43,9 +43,8 @@ def DescribeReferent(ref, drs, definite=True, short=False):
     modifier = None
     prepositions = {}
     
-    for cond in drs.conditions:
-      if (isinstance(cond, drt.drs.PredicateCondition) and
-          cond.informative and ref in cond.args):
+    for cond in drs.GetMentions(ref):
+      if isinstance(cond, drt.drs.PredicateCondition) and cond.informative:
         predicate = cond.predicate
         args = cond.args
         if len(args) == 1: